@@ -1,25 +1,74 @@
 import os
+import errno
+import re
+import atexit
+import base64
+import functools
 import subprocess
 import sys
 import json
 import uuid
 import time
 import socket
+import stat
 import logging
+import textwrap
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Union
-from watchdog.events import FileSystemEventHandler
-from watchdog.observers.polling import PollingObserver as Observer
+from typing import Callable, List, Optional, TypeVar, Union
+from watchdog.events import FileCreatedEvent, FileMovedEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+T = TypeVar("T")
+
+try:
+    import orjson  # Optional: faster JSON for request and result files
+except ImportError:
+    orjson = None
 
 FILECLIP_REQUEST_PREFIX = "fileclip_request_"
 FILECLIP_RESULTS_PREFIX = "fileclip_results_"
+# Request file names as written by write_fileclip_json and check_watcher: the prefix plus a uuid4
+REQUEST_FILE_RE = re.compile(rf"^{FILECLIP_REQUEST_PREFIX}[0-9a-f-]{{36}}\.json$")
+# Results go in a subdirectory so the watcher, which only watches the shared dir itself, never sees its own output
+FILECLIP_RESULTS_DIR = "results"
+# IPC files are written to a temporary name and renamed into place, so only creations and renames matter.
+# Passed to Observer.schedule, which narrows the kernel watch to match (e.g. the inotify mask on Linux).
+IPC_EVENT_FILTER = [FileCreatedEvent, FileMovedEvent]
+
+# Filesystems shared across a VM or network boundary; native file events don't see writes made from the other side
+NETWORK_FS_TYPES = frozenset({
+    "9p", "virtiofs", "fakeowner", "fuse.grpcfuse", "fuse.osxfs", "fuse.sshfs",
+    "cifs", "smb3", "smbfs", "nfs", "nfs4", "vboxsf", "prl_fs", "vmhgfs", "fuse.vmhgfs-fuse", "drvfs",
+})
+MOUNTINFO_PATH = Path("/proc/self/mountinfo")
+
+# Path lists at least this long are stat'ed from a thread pool; stat releases the GIL, so on network
+# mounts the round-trips overlap instead of adding up
+PARALLEL_STAT_THRESHOLD = 8
+PARALLEL_STAT_WORKERS = 32
+
+# Linux-only flag for unnamed temporary files; directories found not to support it are remembered
+O_TMPFILE = getattr(os, "O_TMPFILE", None)
+TMPFILE_UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL}
+_NO_TMPFILE_DIRS = set()
+
+# Persistent PowerShell used for Windows clipboard copies by long-running processes (see enable_persistent_shell)
+POWERSHELL_DONE = "__FILECLIP_DONE__"
+_PS_PROC = None
+_PS_LINES = None
+_USE_PERSISTENT_SHELL = False
 
 # Set up logger
 logger = logging.getLogger("fileclip.file_clip")
 
+@functools.lru_cache(maxsize=1)
 def is_container() -> bool:
     """
-    Detect if running in a container environment.
+    Detect if running in a container environment. The result is cached for the life of the process.
     Returns:
         bool: True if in a container, False otherwise.
     """
@@ -29,20 +78,36 @@ def is_container() -> bool:
         or Path("/vscode").exists()
     )
 
-def translate_path(container_path: Union[str, os.PathLike], container_workspace: str, host_workspace: str) -> str:
+def get_shared_dir(workspace: Optional[str] = None) -> Path:
+    """
+    Get the directory used for request and result files.
+    Args:
+        workspace: Workspace whose .fileclip subdirectory is used when FILECLIP_SHARED_DIR is not set.
+    Returns:
+        Path: FILECLIP_SHARED_DIR if set, else <workspace>/.fileclip, else /tmp/fileclip/.fileclip.
+    """
+    shared_dir = os.getenv("FILECLIP_SHARED_DIR")
+    if shared_dir:
+        return Path(shared_dir)
+    return Path(workspace) / ".fileclip" if workspace else Path("/tmp/fileclip/.fileclip")
+
+def translate_path(container_path: Union[str, os.PathLike], container_workspace: str, host_workspace: str,
+                   _resolved: bool = False) -> str:
     """
     Translate a container path to its host equivalent.
     Args:
         container_path: Path in the container.
         container_workspace: Container workspace root (e.g., /mounted/dev).
         host_workspace: Host workspace root (e.g., C:\\Users\\user\\dev).
+        _resolved: True if container_path and container_workspace are already resolved strings.
     Returns:
         str: Translated host path.
     Raises:
         ValueError: If path is not under container_workspace.
     """
-    container_path = str(Path(container_path).resolve())
-    container_workspace = str(Path(container_workspace).resolve())
+    if not _resolved:
+        container_path = str(Path(container_path).resolve())
+        container_workspace = str(Path(container_workspace).resolve())
     
     if not container_path.startswith(container_workspace):
         raise ValueError(f"Path {container_path} is not under {container_workspace}")
@@ -51,15 +116,18 @@ def translate_path(container_path: Union[str, os.PathLike], container_workspace:
     
     return os.path.join(host_workspace, rel_path)
 
-def validate_path(path: Union[str, os.PathLike], container_workspace: str) -> bool:
+def validate_path(path: Union[str, os.PathLike], container_workspace: str, _resolved: bool = False) -> bool:
     """
     Validate that a path is under the container workspace.
     Args:
         path: Path to validate.
         container_workspace: Container workspace root.
+        _resolved: True if path and container_workspace are already resolved strings.
     Returns:
         bool: True if valid, False otherwise.
     """
+    if _resolved:
+        return path.startswith(container_workspace)
     try:
         path = Path(path).resolve()
         container_workspace = Path(container_workspace).resolve()
@@ -67,58 +135,215 @@ def validate_path(path: Union[str, os.PathLike], container_workspace: str) -> bo
     except (OSError, ValueError):
         return False
 
+def is_network_fs(path: Union[str, os.PathLike]) -> bool:
+    """
+    Detect if a path is on a network or VM-shared filesystem (Linux only).
+    Args:
+        path: Path to check.
+    Returns:
+        bool: True if the mount containing path has a type in NETWORK_FS_TYPES, False otherwise.
+    """
+    try:
+        mountinfo = MOUNTINFO_PATH.read_text()
+    except OSError:
+        return False
+    path = os.path.realpath(path)
+    best_mount, fs_type = "", None
+    for line in mountinfo.splitlines():
+        fields, _, rest = line.partition(" - ")
+        fields = fields.split()
+        if len(fields) < 5 or not rest:
+            continue
+        mount_point = fields[4].replace("\\040", " ")
+        if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+            if len(mount_point) >= len(best_mount):
+                best_mount, fs_type = mount_point, rest.split()[0]
+    return fs_type in NETWORK_FS_TYPES
+
+def use_polling(path: Union[str, os.PathLike]) -> bool:
+    """
+    Decide whether to watch a directory with PollingObserver instead of the native Observer.
+    Args:
+        path: Directory to be watched.
+    Returns:
+        bool: True if FILECLIP_FORCE_POLLING is set or path is on a network filesystem.
+    """
+    if os.getenv("FILECLIP_FORCE_POLLING", "false").lower() in ("1", "true"):
+        return True
+    return is_network_fs(path)
+
 class ResultsHandler(FileSystemEventHandler):
-    """Handler to detect fileclip_results_<uuid>.json creation."""
-    def __init__(self, results_path: Path, results: dict):
+    """Handler to signal when fileclip_results_<uuid>.json is written."""
+    def __init__(self, results_path: Path, found: threading.Event):
         self.results_path = results_path
-        self.results = results
+        self.results_name = results_path.name
+        self.found = found
 
     def on_created(self, event):
-        if not event.is_directory and Path(event.src_path).name == self.results_path.name:
-            logger.debug(f"ResultsHandler detected result file: {event.src_path}")
-            self.results["found"] = True
+        if not event.is_directory and os.path.basename(event.src_path) == self.results_name:
+            logger.debug("ResultsHandler detected result file: %s", event.src_path)
+            self.found.set()
+
+    def on_moved(self, event):
+        # Results are written to a temporary file and renamed into place
+        if not event.is_directory and os.path.basename(event.dest_path) == self.results_name:
+            logger.debug("ResultsHandler detected result file: %s", event.dest_path)
+            self.found.set()
 
 def wait_for_results(shared_dir: Path, request_id: str, timeout: float = 15.0) -> dict:
     """
-    Wait for fileclip_results_<uuid>.json using watchdog.
+    Wait for results/fileclip_results_<uuid>.json using watchdog.
+    Results written to the shared directory itself, by watchers older than the results subdirectory,
+    are accepted too, so a new fileclip keeps working with an older watcher.
     Args:
-        shared_dir: Directory containing results file.
+        shared_dir: Shared directory whose results subdirectory receives the results file.
         request_id: UUID for the results file.
         timeout: Max wait time in seconds.
     Returns:
         dict: Results from fileclip_results_<uuid>.json or {"success": False, "message": "Timeout"}.
     """
-    results_path = shared_dir / f"{FILECLIP_RESULTS_PREFIX}{request_id}.json"
-    results = {"found": False}
-    handler = ResultsHandler(results_path, results)
-    observer = Observer(timeout=.1)
-    observer.schedule(handler, str(shared_dir), recursive=False)
+    results_dir = shared_dir / FILECLIP_RESULTS_DIR
+    results_dir.mkdir(parents=True, exist_ok=True)
+    results_path = results_dir / f"{FILECLIP_RESULTS_PREFIX}{request_id}.json"
+    legacy_path = shared_dir / results_path.name  # Where older watchers write results
+    found = threading.Event()
+    handler = ResultsHandler(results_path, found)
+    observer = PollingObserver(timeout=.1) if use_polling(results_dir) else Observer()
+    observer.schedule(handler, str(results_dir), recursive=False, event_filter=IPC_EVENT_FILTER)
+    observer.schedule(handler, str(shared_dir), recursive=False, event_filter=IPC_EVENT_FILTER)
     observer.start()
-    
+    if results_path.exists() or legacy_path.exists():  # Watcher may have answered before the observer started
+        found.set()
+
     start_time = time.time()
-    while time.time() - start_time < timeout:
-        if results["found"] and results_path.exists():
-            try:
-                with open(results_path, "r") as f:
-                    data = json.load(f)
-                logger.debug(f"Removing results file {results_path}")
-                results_path.unlink(missing_ok=True)  # Delete after reading
-                observer.stop()
-                observer.join()
+    try:
+        while True:
+            remaining = timeout - (time.time() - start_time)
+            if remaining <= 0 or not found.wait(remaining):
+                break
+            found.clear()
+            for path in (results_path, legacy_path):
+                try:
+                    data = read_json(path)
+                except FileNotFoundError:
+                    continue
+                except (json.JSONDecodeError, OSError) as e:
+                    logger.error("Error reading results file %s: %s", path, e)
+                    continue
+                logger.debug("Removing results file %s", path)
+                try_unlink(path)  # Delete after reading
                 return data
-            except (json.JSONDecodeError, OSError) as e:
-                logger.error(f"Error reading results file {results_path}: {e}")
-                pass
-        time.sleep(0.1)
-    
-    observer.stop()
-    observer.join()
-    logger.debug(f"Timeout waiting for results file {results_path} after {timeout}s")
+    finally:
+        observer.stop()
+        observer.join()
+
+    logger.debug("Timeout waiting for results file %s after %ss", results_path, timeout)
     return {"success": False, "message": f"Timeout waiting for results after {timeout}s"}
 
+def try_unlink(path: Union[str, os.PathLike]):
+    """
+    Delete a file, ignoring it if it is already gone.
+    Args:
+        path: File to delete.
+    Raises:
+        OSError: If the file exists but cannot be deleted.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def _dumps_json(data: dict) -> bytes:
+    """Serialize data to JSON bytes, using orjson when installed (internal)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+def read_json(json_file: Path) -> dict:
+    """
+    Read and parse a JSON file, using orjson when installed.
+    Args:
+        json_file: Path of the JSON file.
+    Returns:
+        dict: Parsed data.
+    Raises:
+        json.JSONDecodeError: If the file is not valid JSON (orjson's error is a subclass).
+        OSError: If the file cannot be read.
+    """
+    with open(json_file, "rb") as f:
+        content = f.read()
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _write_all(fd: int, payload: bytes):
+    """Write payload to fd in one write, looping only on a short write (internal)."""
+    view = memoryview(payload)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _write_linked_tmpfile(json_file: Path, payload: bytes) -> bool:
+    """
+    Write payload to an unnamed O_TMPFILE inode and link it in as json_file, so the file appears
+    fully written without a rename (Linux only; internal).
+    Args:
+        json_file: Final path of the file; it must not exist yet.
+        payload: Bytes to write.
+    Returns:
+        bool: True if written, False if the directory does not support it and the caller should fall back.
+    Raises:
+        OSError: If writing the data fails.
+    """
+    if O_TMPFILE is None or json_file.parent in _NO_TMPFILE_DIRS:
+        return False
+    try:
+        fd = os.open(json_file.parent, O_TMPFILE | os.O_WRONLY, 0o644)
+    except OSError as e:
+        if e.errno in TMPFILE_UNSUPPORTED_ERRNOS:  # Filesystem or kernel without O_TMPFILE support
+            _NO_TMPFILE_DIRS.add(json_file.parent)
+        return False
+    try:
+        _write_all(fd, payload)
+        try:
+            os.link(f"/proc/self/fd/{fd}", json_file)
+        except FileExistsError:  # link() never overwrites; let the rename replace it
+            return False
+        except OSError:  # /proc is unavailable or cannot link here
+            _NO_TMPFILE_DIRS.add(json_file.parent)
+            return False
+    finally:
+        os.close(fd)
+    return True
+
+def write_json_atomic(json_file: Path, data: dict):
+    """
+    Write JSON so watchers never see a partial file: on Linux as an O_TMPFILE linked into place,
+    elsewhere (or if that is unsupported) to a temporary file renamed into place.
+    Args:
+        json_file: Final path of the JSON file.
+        data: Data to serialize.
+    Raises:
+        OSError: If the file cannot be written.
+    """
+    # Serialize first, then hand the bytes to the OS in one write
+    payload = _dumps_json(data)
+    if _write_linked_tmpfile(json_file, payload):
+        return
+    tmp_file = json_file.with_suffix(".json.tmp")
+    try:
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            _write_all(fd, payload)
+        finally:
+            os.close(fd)
+        os.replace(tmp_file, json_file)
+    except OSError:
+        try_unlink(tmp_file)
+        raise
+
 def check_watcher(shared_dir: Path, timeout: float = 15.0) -> bool:
     """
-    Test if the watcher is running by writing a ping file.
+    Test if the watcher is running by writing a ping file and waiting for its result.
     Args:
         shared_dir: Directory for fileclip_request_<uuid>.json.
         timeout: Max wait time in seconds.
@@ -132,25 +357,22 @@ def check_watcher(shared_dir: Path, timeout: float = 15.0) -> bool:
         "sender": f"container_{socket.gethostname()}_{os.getpid()}",
         "request_id": request_id
     }
-    logger.debug(f"Checking watcher: writing ping file {ping_file}")
+    logger.debug("Checking watcher: writing ping file %s", ping_file)
     try:
         shared_dir.mkdir(parents=True, exist_ok=True)
-        with open(ping_file, "w") as f:
-            json.dump(ping_data, f)
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if not ping_file.exists():
-                logger.debug(f"Watcher responded: ping file {ping_file} deleted")
-                return True
-            time.sleep(0.1)
-        logger.debug(f"Watcher check timed out after {timeout}s: ping file {ping_file} still exists")
+        write_json_atomic(ping_file, ping_data)
+        # Wait on the ping's result file like a copy request, rather than polling for the ping file's removal
+        if wait_for_results(shared_dir, request_id, timeout).get("success", False):
+            logger.debug("Watcher responded to ping %s", request_id)
+            return True
+        logger.debug("Watcher check timed out after %ss: no result for ping file %s", timeout, ping_file)
         return False
     except OSError as e:
-        logger.error(f"Error writing ping file {ping_file}: {e}")
+        logger.error("Error writing ping file %s: %s", ping_file, e)
         return False
     finally:
-        ping_file.unlink(missing_ok=True)
-        logger.debug(f"Cleaned up ping file {ping_file}")
+        try_unlink(ping_file)
+        logger.debug("Cleaned up ping file %s", ping_file)
 
 def write_fileclip_json(shared_dir: Path, paths: List[str], sender: str) -> tuple[str, Path]:
     """
@@ -171,11 +393,32 @@ def write_fileclip_json(shared_dir: Path, paths: List[str], sender: str) -> tupl
         "paths": paths
     }
     shared_dir.mkdir(parents=True, exist_ok=True)
-    with open(json_file, "w") as f:
-        json.dump(data, f)
-    logger.debug(f"Wrote fileclip request: {json_file}")
+    write_json_atomic(json_file, data)
+    logger.debug("Wrote fileclip request: %s", json_file)
     return request_id, json_file
 
+def map_paths(func: Callable[[str], T], paths: List[str]) -> List[T]:
+    """
+    Apply a filesystem check (stat, isfile, ...) to each path, from a thread pool for longer lists.
+    Args:
+        func: Function to call with each path.
+        paths: Paths to check.
+    Returns:
+        List of results, in the order of paths.
+    """
+    if len(paths) < PARALLEL_STAT_THRESHOLD:
+        return [func(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(PARALLEL_STAT_WORKERS, len(paths))) as executor:
+        return list(executor.map(func, paths))
+
+def _resolve_file(path: Union[str, os.PathLike]) -> Optional[str]:
+    """Return the resolved path if it is a regular file, None otherwise (internal)."""
+    abs_path = os.path.realpath(path)
+    try:
+        return abs_path if stat.S_ISREG(os.stat(abs_path).st_mode) else None
+    except OSError:
+        return None
+
 def copy_files(file_paths: List[Union[str, os.PathLike]], use_watcher: bool = None, watcher_timeout: float = 15.0) -> bool:
     """
     Copy a list of file paths to the system clipboard as file references.
@@ -191,12 +434,10 @@ def copy_files(file_paths: List[Union[str, os.PathLike]], use_watcher: bool = No
         ValueError: If watcher is used but paths are invalid or env vars are missing.
     """
     # Validate file paths
-    valid_paths = []
-    for path in file_paths:
-        abs_path = Path(path).resolve()
-        if not abs_path.is_file():
+    valid_paths = map_paths(_resolve_file, list(file_paths))
+    for path, abs_path in zip(file_paths, valid_paths):
+        if abs_path is None:
             raise FileNotFoundError(f"File not found or not a file: {path}")
-        valid_paths.append(str(abs_path))
 
     if not valid_paths:
         print("No valid files to copy.")
@@ -205,7 +446,7 @@ def copy_files(file_paths: List[Union[str, os.PathLike]], use_watcher: bool = No
     # Container and watcher logic
     container_workspace = os.getenv("FILECLIP_CONTAINER_WORKSPACE")
     host_workspace = os.getenv("FILECLIP_HOST_WORKSPACE")
-    shared_dir = Path(container_workspace) / ".fileclip" if container_workspace else Path("/tmp/fileclip/.fileclip")
+    shared_dir = get_shared_dir(container_workspace)
     
     use_watcher_env = os.getenv("FILECLIP_USE_WATCHER", "true" if is_container() else "false").lower() == "true"
     use_watcher = use_watcher_env if use_watcher is None else use_watcher
@@ -214,12 +455,13 @@ def copy_files(file_paths: List[Union[str, os.PathLike]], use_watcher: bool = No
         if not (container_workspace and host_workspace):
             raise ValueError("FILECLIP_CONTAINER_WORKSPACE and FILECLIP_HOST_WORKSPACE must be set for watcher mode")
         
-        # Validate and translate paths
+        # Validate and translate paths (valid_paths are already resolved)
+        resolved_workspace = os.path.realpath(container_workspace)
         translated_paths = []
         for path in valid_paths:
-            if not validate_path(path, container_workspace):
+            if not validate_path(path, resolved_workspace, _resolved=True):
                 raise ValueError(f"Path {path} is not under {container_workspace}")
-            translated_paths.append(translate_path(path, container_workspace, host_workspace))
+            translated_paths.append(translate_path(path, resolved_workspace, host_workspace, _resolved=True))
         
         # Test watcher
         logger.debug("Testing watcher availability")
@@ -233,7 +475,7 @@ def copy_files(file_paths: List[Union[str, os.PathLike]], use_watcher: bool = No
         request_id, json_file = write_fileclip_json(shared_dir, translated_paths, sender)
         
         # Wait for results
-        logger.debug(f"Waiting for watcher results for request {request_id}")
+        logger.debug("Waiting for watcher results for request %s", request_id)
         results = wait_for_results(shared_dir, request_id, watcher_timeout)
         if results.get("success", False):
             print(f"Files copied to clipboard via watcher: {results.get('message', '')}")
@@ -247,132 +489,240 @@ def copy_files(file_paths: List[Union[str, os.PathLike]], use_watcher: bool = No
 
     return _copy_files_direct(valid_paths)
 
-def _copy_files_direct(file_paths: List[str]) -> bool:
-    """Direct clipboard copy using subprocess (internal)."""
-    if sys.platform == "win32":  # Windows
-        paths = ','.join(f'"{p}"' for p in file_paths)
-        cmd = f'powershell.exe -Command "Set-Clipboard -Path {paths}"'
-        print(f"Executing Windows command: {cmd}")
-        try:
-            subprocess.run(
-                cmd, shell=True, capture_output=True, text=True, timeout=5, check=True, env=os.environ.copy()
-            )
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Windows clipboard error: {e.stderr}")
-        print("Files copied to clipboard (Windows).")
-        return True
-
-    elif sys.platform == "darwin":  # macOS
-        import textwrap
-
-        applescript = textwrap.dedent('''
-        use framework "AppKit"
-
-        property this : a reference to current application
-        property NSFileManager : a reference to NSFileManager of this
-        property NSMutableArray : a reference to NSMutableArray of this
-        property NSPasteboard : a reference to NSPasteboard of this
-        property NSString : a reference to NSString of this
-        property NSURL : a reference to NSURL of this
-
-        property pb : missing value
-
-        on run input
-            init()
-            clearClipboard()
-            addToClipboard(input)
-        end run
-
-        to init()
-            set pb to NSPasteboard's generalPasteboard()
-        end init
-
-        to clearClipboard()
-            if pb = missing value then init()
-            pb's clearContents()
-        end clearClipboard
-
-        to addToClipboard(fs)
-            local fs
+def enable_persistent_shell(enabled: bool = True):
+    """
+    Reuse one PowerShell process for all Windows clipboard copies instead of starting one per copy.
+    Meant for long-running callers such as the watcher; one-shot CLI runs gain nothing from it.
+    Args:
+        enabled (bool): Whether to use the persistent process.
+    """
+    global _USE_PERSISTENT_SHELL
+    _USE_PERSISTENT_SHELL = enabled
 
-            set fURLs to NSMutableArray's array()
-            set FileManager to NSFileManager's defaultManager()
+def _close_powershell():
+    """Terminate the persistent PowerShell process, if any (internal)."""
+    global _PS_PROC
+    if _PS_PROC is not None and _PS_PROC.poll() is None:
+        _PS_PROC.terminate()
+    _PS_PROC = None
 
-            repeat with f in fs
-                set fp to (NSString's stringWithString:f)'s stringByStandardizingPath()
-                if (FileManager's fileExistsAtPath:fp) then ¬
-                    (fURLs's addObject:(NSURL's fileURLWithPath:fp))
-            end repeat
+atexit.register(_close_powershell)
 
-            if pb = missing value then init()
-            pb's writeObjects:fURLs
-        end addToClipboard
-        '''.strip())
+def _read_lines(stream, lines: queue.Queue):
+    """Forward lines from a subprocess stream to a queue, then None at EOF (internal)."""
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
 
-        cmd = ["osascript", "-e", applescript] + file_paths
-        print(f"Executing macOS clipboard command (AppKit method) with {len(file_paths)} files.")
+def _get_powershell() -> subprocess.Popen:
+    """
+    Get the persistent PowerShell process, starting it if it is not running (internal).
+    Returns:
+        subprocess.Popen: PowerShell reading commands from stdin.
+    Raises:
+        OSError: If PowerShell cannot be started.
+    """
+    global _PS_PROC, _PS_LINES
+    if _PS_PROC is None or _PS_PROC.poll() is not None:
+        _PS_PROC = subprocess.Popen(
+            ["powershell.exe", "-NoProfile", "-NoLogo", "-NonInteractive", "-Command", "-"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            encoding="utf-8", errors="replace"
+        )
+        _PS_LINES = queue.Queue()
+        threading.Thread(target=_read_lines, args=(_PS_PROC.stdout, _PS_LINES), daemon=True).start()
+    return _PS_PROC
+
+def _run_persistent_powershell(command: str, timeout: float = 5.0):
+    """
+    Run a command in the persistent PowerShell process and wait for it to finish (internal).
+    PowerShell decodes stdin and encodes stdout with the console code page, so the command and any
+    error message cross the pipe base64-encoded (like -EncodedCommand) to keep non-ASCII paths intact.
+    Args:
+        command (str): PowerShell command to run.
+        timeout (float): Seconds to wait for the command.
+    Raises:
+        RuntimeError: If the command fails.
+        OSError: If the process cannot be started, exits, or does not answer in time.
+    """
+    proc = _get_powershell()
+    encoded = base64.b64encode(command.encode("utf-16-le")).decode("ascii")
+    try:
+        proc.stdin.write(
+            f"try {{ $ErrorActionPreference = 'Stop'; "
+            f"& ([ScriptBlock]::Create([Text.Encoding]::Unicode.GetString([Convert]::FromBase64String('{encoded}')))); "
+            f"Write-Output '{POWERSHELL_DONE}' }} "
+            f"catch {{ Write-Output ('{POWERSHELL_DONE}' + [Convert]::ToBase64String([Text.Encoding]::UTF8.GetBytes(\"$_\"))) }}\n"
+        )
+        proc.stdin.flush()
+        deadline = time.monotonic() + timeout
+        while True:
+            line = _PS_LINES.get(timeout=max(0.0, deadline - time.monotonic()))
+            if line is None:
+                raise OSError("PowerShell process exited")
+            if line.startswith(POWERSHELL_DONE):
+                break
+    except queue.Empty:
+        _close_powershell()
+        raise OSError(f"PowerShell did not respond within {timeout}s") from None
+    except OSError:
+        _close_powershell()
+        raise
+    error = line[len(POWERSHELL_DONE):].strip()
+    if error:
+        raise RuntimeError(f"Windows clipboard error: {base64.b64decode(error).decode('utf-8', 'replace')}")
+
+def _copy_win(file_paths: List[str]) -> bool:
+    """Copy files to the Windows clipboard with PowerShell's Set-Clipboard (internal)."""
+    # Single-quoted PowerShell strings are literal; the only escape is doubling the quote
+    paths = ','.join("'" + p.replace("'", "''") + "'" for p in file_paths)
+    command = f"Set-Clipboard -LiteralPath @({paths})"
+    if _USE_PERSISTENT_SHELL:
+        try:
+            _run_persistent_powershell(command)
+            print("Files copied to clipboard (Windows).")
+            return True
+        except OSError as e:
+            logger.warning("Persistent PowerShell unavailable (%s); starting a new one for this copy", e)
+    cmd = ["powershell.exe", "-NoProfile", "-NonInteractive", "-Command", command]
+    print(f"Executing Windows command: {command}")
+    try:
+        subprocess.run(
+            cmd, capture_output=True, text=True, timeout=5, check=True
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Windows clipboard error: {e.stderr}")
+    print("Files copied to clipboard (Windows).")
+    return True
+
+# AppleScript run by osascript on macOS; the file paths are passed as its arguments
+MACOS_CLIPBOARD_SCRIPT = textwrap.dedent('''
+    use framework "AppKit"
+
+    property this : a reference to current application
+    property NSFileManager : a reference to NSFileManager of this
+    property NSMutableArray : a reference to NSMutableArray of this
+    property NSPasteboard : a reference to NSPasteboard of this
+    property NSString : a reference to NSString of this
+    property NSURL : a reference to NSURL of this
+
+    property pb : missing value
+
+    on run input
+        init()
+        clearClipboard()
+        addToClipboard(input)
+    end run
+
+    to init()
+        set pb to NSPasteboard's generalPasteboard()
+    end init
+
+    to clearClipboard()
+        if pb = missing value then init()
+        pb's clearContents()
+    end clearClipboard
+
+    to addToClipboard(fs)
+        local fs
+
+        set fURLs to NSMutableArray's array()
+        set FileManager to NSFileManager's defaultManager()
+
+        repeat with f in fs
+            set fp to (NSString's stringWithString:f)'s stringByStandardizingPath()
+            if (FileManager's fileExistsAtPath:fp) then ¬
+                (fURLs's addObject:(NSURL's fileURLWithPath:fp))
+        end repeat
+
+        if pb = missing value then init()
+        pb's writeObjects:fURLs
+    end addToClipboard
+    ''').strip()
+
+def _copy_mac(file_paths: List[str]) -> bool:
+    """Copy files to the macOS clipboard with an AppKit script run by osascript (internal)."""
+    cmd = ["osascript", "-e", MACOS_CLIPBOARD_SCRIPT] + file_paths
+    print(f"Executing macOS clipboard command (AppKit method) with {len(file_paths)} files.")
 
+    try:
+        subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=8,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"AppleScript failed: {e.stderr.strip()}") from e
+
+    print("Files copied to clipboard (macOS).")
+    return True
+
+def _copy_linux(file_paths: List[str]) -> bool:
+    """Copy file URIs to the Linux clipboard, trying wl-copy and then xclip (internal)."""
+    # Build the uri-list as bytes once for both wl-copy and xclip; os.fsencode keeps undecodable file names intact
+    uri_list = b'\n'.join(b'file://' + os.fsencode(p) for p in file_paths)
+    uris = os.fsdecode(uri_list)
+    # Read the display settings once per copy; they are not cached across calls since the environment can change
+    wayland_display = os.environ.get("WAYLAND_DISPLAY")
+    display = os.environ.get("DISPLAY")
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+
+    # Inherit the environment as is unless XDG_RUNTIME_DIR has to be filled in
+    env = None
+    if not runtime_dir and hasattr(os, 'getuid'):
+        runtime_dir = f"/run/user/{os.getuid()}"
+        env = {**os.environ, 'XDG_RUNTIME_DIR': runtime_dir}
+
+    if wayland_display:
+        print(f"Attempting Wayland clipboard with wl-copy (WAYLAND_DISPLAY={wayland_display}, XDG_RUNTIME_DIR={runtime_dir})")
+        cmd = ['wl-copy', '--type', 'text/uri-list']
+        print(f"Executing Wayland command: {' '.join(cmd)} with input:\n{uris}")
         try:
             subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=8,
-                check=True,
-                env=os.environ.copy(),
+                cmd, input=uri_list, capture_output=True, check=True, timeout=5, env=env
             )
+            print("Files copied to clipboard (Wayland).")
+            return True
         except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"AppleScript failed: {e.stderr.strip()}") from e
+            raise RuntimeError(f"Wayland clipboard error: {e.stderr.decode('utf-8', errors='replace')}")
+        except FileNotFoundError:
+            print("wl-clipboard not found, falling back to xclip.")
+        except subprocess.TimeoutExpired as e:
+            print(f"Wayland clipboard operation timed out: cmd={e.cmd}, timeout={e.timeout}, stdout={e.stdout.decode('utf-8', errors='replace') if e.stdout else 'None'}, stderr={e.stderr.decode('utf-8', errors='replace') if e.stderr else 'None'}")
+            print("Falling back to xclip.")
+
+    if display:
+        print(f"Attempting X11 clipboard with xclip (DISPLAY={display})")
+        cmd = ['xclip', '-selection', 'clipboard', '-t', 'text/uri-list']
+        print(f"Executing X11 command: {' '.join(cmd)} with input:\n{uris}")
+        try:
+            subprocess.run(
+                cmd, input=uri_list, capture_output=True, check=True, timeout=5, env=env
+            )
+            print("Files copied to clipboard (X11).")
+            return True
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"X11 clipboard error: {e.stderr.decode('utf-8', errors='replace')}")
+        except FileNotFoundError:
+            raise RuntimeError("xclip not found. Install with 'sudo apt install xclip' or equivalent.")
+        except subprocess.TimeoutExpired as e:
+            print(f"X11 clipboard operation timed out: cmd={e.cmd}, timeout={e.timeout}, stdout={e.stdout.decode('utf-8', errors='replace') if e.stdout else 'None'}, stderr={e.stderr.decode('utf-8', errors='replace') if e.stderr else 'None'}")
 
-        print("Files copied to clipboard (macOS).")
-        return True
+    print("No functional display server detected (WAYLAND_DISPLAY or DISPLAY set but unresponsive).")
+    print("File URIs (copy manually):")
+    for uri in uris.split('\n'):
+        print(uri)
+    return False
 
-    elif sys.platform == "linux":  # Linux (try wl-clipboard, then xclip)
-        uris = '\n'.join(f'file://{p}' for p in file_paths)
-        env = os.environ.copy()
-        if not env.get('XDG_RUNTIME_DIR') and hasattr(os, 'getuid'):
-            env['XDG_RUNTIME_DIR'] = f"/run/user/{os.getuid()}"
-
-        if os.getenv("WAYLAND_DISPLAY"):
-            print(f"Attempting Wayland clipboard with wl-copy (WAYLAND_DISPLAY={os.getenv('WAYLAND_DISPLAY')}, XDG_RUNTIME_DIR={env.get('XDG_RUNTIME_DIR')})")
-            cmd = ['wl-copy', '--type', 'text/uri-list']
-            print(f"Executing Wayland command: {' '.join(cmd)} with input:\n{uris}")
-            try:
-                subprocess.run(
-                    cmd, input=uris.encode(), capture_output=True, check=True, timeout=5, env=env
-                )
-                print("Files copied to clipboard (Wayland).")
-                return True
-            except subprocess.CalledProcessError as e:
-                raise RuntimeError(f"Wayland clipboard error: {e.stderr.decode('utf-8', errors='replace')}")
-            except FileNotFoundError:
-                print("wl-clipboard not found, falling back to xclip.")
-            except subprocess.TimeoutExpired as e:
-                print(f"Wayland clipboard operation timed out: cmd={e.cmd}, timeout={e.timeout}, stdout={e.stdout.decode('utf-8', errors='replace') if e.stdout else 'None'}, stderr={e.stderr.decode('utf-8', errors='replace') if e.stderr else 'None'}")
-                print("Falling back to xclip.")
-
-        if os.getenv("DISPLAY"):
-            print(f"Attempting X11 clipboard with xclip (DISPLAY={os.getenv('DISPLAY')})")
-            cmd = ['xclip', '-selection', 'clipboard', '-t', 'text/uri-list']
-            print(f"Executing X11 command: {' '.join(cmd)} with input:\n{uris}")
-            try:
-                subprocess.run(
-                    cmd, input=uris.encode(), capture_output=True, check=True, timeout=5, env=env
-                )
-                print("Files copied to clipboard (X11).")
-                return True
-            except subprocess.CalledProcessError as e:
-                raise RuntimeError(f"X11 clipboard error: {e.stderr.decode('utf-8', errors='replace')}")
-            except FileNotFoundError:
-                raise RuntimeError("xclip not found. Install with 'sudo apt install xclip' or equivalent.")
-            except subprocess.TimeoutExpired as e:
-                print(f"X11 clipboard operation timed out: cmd={e.cmd}, timeout={e.timeout}, stdout={e.stdout.decode('utf-8', errors='replace') if e.stdout else 'None'}, stderr={e.stderr.decode('utf-8', errors='replace') if e.stderr else 'None'}")
-
-        print("No functional display server detected (WAYLAND_DISPLAY or DISPLAY set but unresponsive).")
-        print("File URIs (copy manually):")
-        for uri in uris.split('\n'):
-            print(uri)
-        return False
+def _copy_unsupported(file_paths: List[str]) -> bool:
+    """Raise for platforms without clipboard support (internal)."""
+    raise RuntimeError(f"Unsupported platform: {sys.platform}")
 
-    else:
-        raise RuntimeError(f"Unsupported platform: {sys.platform}")
\ No newline at end of file
+# Clipboard copy implementation for each supported sys.platform
+COPY_IMPLS = {"win32": _copy_win, "darwin": _copy_mac, "linux": _copy_linux}
+
+def _copy_files_direct(file_paths: List[str]) -> bool:
+    """Direct clipboard copy using subprocess (internal)."""
+    return COPY_IMPLS.get(sys.platform, _copy_unsupported)(file_paths)
\ No newline at end of file
@@ -1,150 +1,320 @@
 import argparse
+import atexit
 import json
 import logging
 import os
+import queue
+import signal
 import sys
+import threading
 import time
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import List, Optional
 
-from watchdog.events import PatternMatchingEventHandler
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
 
-from .file_clip import copy_files, FILECLIP_REQUEST_PREFIX, FILECLIP_RESULTS_PREFIX
+from .file_clip import copy_files, enable_persistent_shell, get_shared_dir, map_paths, read_json, try_unlink, use_polling, write_json_atomic, FILECLIP_RESULTS_PREFIX, FILECLIP_RESULTS_DIR, IPC_EVENT_FILTER, REQUEST_FILE_RE
 
 # Use a named logger
 logger = logging.getLogger("fileclip.watcher")
 
+# Background writer for the log file, started by setup_logging
+_LOG_LISTENER = None
+
+# Seconds between directory scans when polling; a request's own work (JSON, clipboard) outweighs a longer tick
+POLL_INTERVAL = 1.0
+
+# Seconds between checks for Ctrl+C while the Windows watcher idles (signals cannot interrupt a lock wait there)
+WINDOWS_SIGNAL_CHECK_INTERVAL = 1.0
+
+# Keys every request must carry so its result can be routed back to the sender
+REQUIRED_REQUEST_KEYS = frozenset({"sender", "request_id"})
+
+# Seconds the worker keeps collecting requests after the first one, so a burst shares one clipboard copy
+BATCH_WINDOW = 0.05
+
 def setup_logging(log_file: Path, log_level: str):
     """
     Set up logging to file with specified level.
+    Records are handed to a queue and written by a background listener thread, so request handling
+    never waits on log file I/O (which may be on the same network share as the requests).
     Args:
         log_file: Path to log file.
         log_level: Logging level (e.g., DEBUG, INFO, ERROR).
     """
+    global _LOG_LISTENER
     log_file.parent.mkdir(parents=True, exist_ok=True)
     level = getattr(logging, log_level.upper(), logging.INFO)
     logger = logging.getLogger("fileclip.watcher")
     # Reset logger state
+    stop_logging()
     logger.handlers = []  # Clear existing handlers
     logger.setLevel(level)
     logger.propagate = True  # Ensure logs propagate for caplog
     handler = logging.FileHandler(log_file)
     handler.setLevel(level)
     handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(handler)
-    logger.debug(f"Logging initialized with level {log_level} to {log_file}")
+    log_queue = queue.SimpleQueue()
+    _LOG_LISTENER = QueueListener(log_queue, handler, respect_handler_level=True)
+    _LOG_LISTENER.start()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.debug("Logging initialized with level %s to %s", log_level, log_file)
+
+def stop_logging():
+    """Write out any queued log records, close the log file, and stop the listener thread."""
+    global _LOG_LISTENER
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.stop()
+        for handler in _LOG_LISTENER.handlers:
+            handler.close()
+        _LOG_LISTENER = None
+
+atexit.register(stop_logging)
 
 def write_result(shared_dir: Path, request_id: str, result: dict):
     """
-    Write result to fileclip_results_<uuid>.json.
+    Write result to results/fileclip_results_<uuid>.json.
     Args:
-        shared_dir: Directory for the result file.
+        shared_dir: Shared directory; the result file goes in its results subdirectory.
         request_id: UUID for the result file.
         result: Result dictionary to write.
     """
-    result_file = shared_dir / f"{FILECLIP_RESULTS_PREFIX}{request_id}.json"
+    result_file = shared_dir / FILECLIP_RESULTS_DIR / f"{FILECLIP_RESULTS_PREFIX}{request_id}.json"
     try:
-        with open(result_file, "w") as f:
-            json.dump(result, f)
-        logger.info(f"Wrote result to {result_file}")
+        result_file.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(result_file, result)
+        logger.info("Wrote result to %s", result_file)
     except OSError as e:
-        logger.error(f"Failed to write result to {result_file}: {str(e)}")
+        logger.error("Failed to write result to %s: %s", result_file, e)
 
-def process_file(file_path: Path, shared_dir: Path):
+def make_result(data: dict, success: bool, message: str, errors: Optional[List[str]] = None) -> dict:
     """
-    Process a fileclip JSON file.
+    Build the result for a request.
     Args:
-        file_path: Path to the JSON file.
-        shared_dir: Directory for results.
+        data: Request data; sender and request_id are copied from it.
+        success: Whether the request succeeded.
+        message: Summary message.
+        errors: Error details, if any.
+    Returns:
+        dict: Result to write with write_result.
     """
-    logger.debug(f"Starting to process file: {file_path}")
-    result = {
-        "success": False,
-        "message": "",
-        "sender": "unknown",
-        "request_id": "unknown",
-        "errors": []
+    return {
+        "success": success,
+        "message": message,
+        "sender": data.get("sender", "unknown"),
+        "request_id": data.get("request_id", "unknown"),
+        "errors": errors if errors is not None else []
     }
 
+def read_request(file_path: Path, shared_dir: Path) -> Optional[dict]:
+    """
+    Read and validate a fileclip JSON file, writing an error result if it is unusable.
+    Args:
+        file_path: Path to the JSON file.
+        shared_dir: Directory for results.
+    Returns:
+        dict: Request data, or None if the file could not be read or is missing sender/request_id.
+    """
     try:
-        with open(file_path, "r") as f:
-            data = json.load(f)
-        logger.debug(f"Successfully read JSON from {file_path}: {data}")
+        data = read_json(file_path)
+        logger.debug("Successfully read JSON from %s: %s", file_path, data)
     except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in {file_path}")
-        result["message"] = "Invalid JSON"
-        write_result(shared_dir, "unknown", result)
-        file_path.unlink(missing_ok=True)
-        return
+        logger.error("Invalid JSON in %s", file_path)
+        write_result(shared_dir, "unknown", make_result({}, False, "Invalid JSON"))
+        return None
+    except FileNotFoundError:
+        logger.debug("Request file %s already handled", file_path)
+        return None
     except OSError as e:
-        logger.error(f"Error processing {file_path}: {str(e)}")
-        result["message"] = f"Failed to read file: {str(e)}"
-        write_result(shared_dir, "unknown", result)
-        file_path.unlink(missing_ok=True)
-        return
+        logger.error("Error processing %s: %s", file_path, e)
+        write_result(shared_dir, "unknown", make_result({}, False, f"Failed to read file: {str(e)}"))
+        return None
 
-    # Check for missing sender or request_id directly
-    if "sender" not in data or "request_id" not in data:
-        result["message"] = "Missing request_id or sender"
-        write_result(shared_dir, result["request_id"], result)
-        file_path.unlink(missing_ok=True)
-        return
+    # A single key-view comparison; a non-object payload (list, string) is rejected the same way.
+    # Both values must be strings: request_id names the result file and sender groups copies.
+    if (not isinstance(data, dict) or not REQUIRED_REQUEST_KEYS <= data.keys()
+            or not all(isinstance(data[key], str) for key in REQUIRED_REQUEST_KEYS)):
+        write_result(shared_dir, "unknown", make_result({}, False, "Missing request_id or sender"))
+        return None
 
-    result["sender"] = data.get("sender", "unknown")
-    result["request_id"] = data.get("request_id", "unknown")
+    return data
 
-    action = data.get("action")
-    if action == "ping":
-        result["success"] = True
-        result["message"] = "Ping acknowledged"
-        write_result(shared_dir, result["request_id"], result)
-    elif action == "copy_files":
-        paths = data.get("paths", [])
+def copy_requests(requests: List[dict], shared_dir: Path):
+    """
+    Handle one or more copy_files requests with a single clipboard copy, writing a result per request.
+    Args:
+        requests: Request data for copy_files actions, normally all from one sender.
+        shared_dir: Directory for results.
+    """
+    unique_paths = list(dict.fromkeys(path for data in requests for path in data.get("paths", [])))
+    is_file = dict(zip(unique_paths, map_paths(os.path.isfile, unique_paths)))
+    checked = []
+    merged = {}  # Insertion-ordered set of valid paths across all requests
+    for data in requests:
         valid_paths = []
         errors = []
-        for path in paths:
-            path_obj = Path(path)
-            if path_obj.is_file():
-                valid_paths.append(str(path_obj))
+        for path in data.get("paths", []):
+            if is_file[path]:
+                valid_paths.append(path)
             else:
                 errors.append(f"Invalid or inaccessible path: {path}")
-                logger.error(f"Invalid path: {path}")
-        if valid_paths:
-            try:
-                logger.debug(f"Calling copy_files with paths: {valid_paths}")
-                success = copy_files(valid_paths, use_watcher=False)
-                result["success"] = success
-                result["message"] = f"Copied {len(valid_paths)} file(s)" if success else "Failed to copy files"
-                result["errors"] = errors
-                logger.info(result["message"])
-            except Exception as e:  # pylint: disable=broad-except
-                logger.error(f"Failed to copy files: {str(e)}")
-                result["message"] = f"Failed to copy files: {str(e)}"
-                result["errors"] = [str(e)] + errors
-        else:
-            result["message"] = "No valid files to copy"
-            result["errors"] = errors
+                logger.error("Invalid path: %s", path)
+        checked.append((data, valid_paths, errors))
+        merged.update(dict.fromkeys(valid_paths))
+    merged_paths = list(merged)
+
+    success = False
+    copy_error = None
+    if merged_paths:
+        try:
+            logger.debug("Calling copy_files with paths: %s", merged_paths)
+            success = copy_files(merged_paths, use_watcher=False)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Failed to copy files: %s", e)
+            copy_error = str(e)
+
+    for data, valid_paths, errors in checked:
+        if not valid_paths:
+            result = make_result(data, False, "No valid files to copy", errors)
             logger.error(result["message"])
+        elif copy_error is not None:
+            result = make_result(data, False, f"Failed to copy files: {copy_error}", [copy_error] + errors)
+        else:
+            result = make_result(data, success, f"Copied {len(valid_paths)} file(s)" if success else "Failed to copy files", errors)
+            logger.info(result["message"])
         write_result(shared_dir, result["request_id"], result)
-    else:
-        result["message"] = f"Unknown action: {action}"
-        logger.error(result["message"])
-        write_result(shared_dir, result["request_id"], result)
 
-    file_path.unlink(missing_ok=True)
-    logger.debug(f"Finished processing file: {file_path}")
+def _report_failure(data: dict, shared_dir: Path, error: Exception):
+    """Write a failure result for a request whose handling raised (internal)."""
+    result = make_result(data, False, f"Failed to process request: {error}", [str(error)])
+    logger.error("Failed to process request %s: %s", result["request_id"], error)
+    write_result(shared_dir, result["request_id"], result)
+
+def _do_ping(data: dict, shared_dir: Path):
+    """Answer a ping request (internal)."""
+    write_result(shared_dir, data["request_id"], make_result(data, True, "Ping acknowledged"))
+
+def _do_copy(data: dict, shared_dir: Path):
+    """Copy the files in a single copy_files request (internal)."""
+    copy_requests([data], shared_dir)
+
+# Handler for each request action; each one writes the request's result
+ACTIONS = {"ping": _do_ping, "copy_files": _do_copy}
 
-class FileclipHandler(PatternMatchingEventHandler):
+def handle_request(data: dict, shared_dir: Path):
     """
-    Watchdog handler for fileclip JSON files.
+    Perform the action in a validated request and write its result.
+    Args:
+        data: Request data with sender and request_id.
+        shared_dir: Directory for results.
+    """
+    action = data.get("action")
+    handler = ACTIONS.get(action)
+    if handler is not None:
+        handler(data, shared_dir)
+        return
+    result = make_result(data, False, f"Unknown action: {action}")
+    logger.error(result["message"])
+    write_result(shared_dir, result["request_id"], result)
+
+def _remove_request(file_path: Path) -> bool:
+    """
+    Delete a handled request file, logging instead of raising if it cannot be deleted (internal).
+    Returns:
+        bool: False if the file is still there (e.g. locked by another process on Windows).
+    """
+    try:
+        try_unlink(file_path)
+        return True
+    except OSError as e:
+        logger.error("Failed to remove request file %s: %s", file_path, e)
+        return False
+
+def process_file(file_path: Path, shared_dir: Path) -> bool:
+    """
+    Process a fileclip JSON file.
+    Args:
+        file_path: Path to the JSON file.
+        shared_dir: Directory for results.
+    Returns:
+        bool: False if the request file could not be removed afterwards.
+    """
+    logger.debug("Starting to process file: %s", file_path)
+    data = None
+    try:
+        data = read_request(file_path, shared_dir)
+        if data is not None:
+            handle_request(data, shared_dir)
+    except Exception as e:  # pylint: disable=broad-except
+        _report_failure(data or {}, shared_dir, e)
+    finally:
+        removed = _remove_request(file_path)
+    logger.debug("Finished processing file: %s", file_path)
+    return removed
+
+def process_batch(file_paths: List[Path], shared_dir: Path) -> List[Path]:
+    """
+    Process several fileclip JSON files, merging copy_files requests from the same sender
+    into a single clipboard copy.
+    Args:
+        file_paths: Paths to the JSON files.
+        shared_dir: Directory for results.
+    Returns:
+        List[Path]: Request files that could not be removed afterwards.
+    """
+    if len(file_paths) == 1:
+        return [] if process_file(file_paths[0], shared_dir) else list(file_paths)
+
+    logger.debug("Processing batch of %s files", len(file_paths))
+    copy_groups = {}
+    stuck = []
+    for file_path in file_paths:
+        data = None
+        try:
+            data = read_request(file_path, shared_dir)
+            if data is not None and data.get("action") == "copy_files":
+                copy_groups.setdefault(data["sender"], []).append(data)
+            elif data is not None:
+                handle_request(data, shared_dir)
+        except Exception as e:  # pylint: disable=broad-except
+            _report_failure(data or {}, shared_dir, e)
+        finally:
+            if not _remove_request(file_path):
+                stuck.append(file_path)
+
+    for sender, requests in copy_groups.items():
+        logger.debug("Copying %s request(s) from %s", len(requests), sender)
+        try:
+            copy_requests(requests, shared_dir)
+        except Exception as e:  # pylint: disable=broad-except
+            # Answer this sender's requests and carry on with the other groups
+            for data in requests:
+                _report_failure(data, shared_dir, e)
+    return stuck
+
+class FileclipHandler(FileSystemEventHandler):
+    """
+    Watchdog handler for fileclip JSON files. Events are queued and drained in batches
+    by a worker thread so bursts of requests share one clipboard copy. File names are
+    matched against the precompiled REQUEST_FILE_RE rather than watchdog's fnmatch patterns.
     Args:
         shared_dir: Directory to monitor and write results to.
+        batch_window: Seconds to keep collecting requests after the first one of a batch.
     """
 
-    def __init__(self, shared_dir: Path):
-        super().__init__(patterns=[f"{FILECLIP_REQUEST_PREFIX}*.json"], ignore_directories=True)
+    def __init__(self, shared_dir: Path, batch_window: float = BATCH_WINDOW):
+        super().__init__()
         self.shared_dir = shared_dir
-        logger.debug(f"Initialized FileclipHandler for {shared_dir}")
+        self.batch_window = batch_window
+        self.q = queue.Queue()
+        # Handled request files that could not be deleted; skipped until they are gone (worker thread only)
+        self.stuck = set()
+        self.worker = threading.Thread(target=self._drain, name="fileclip-worker", daemon=True)
+        self.worker.start()
+        logger.debug("Initialized FileclipHandler for %s", shared_dir)
 
     def on_created(self, event):
         """
@@ -152,15 +322,127 @@ class FileclipHandler(PatternMatchingEventHandler):
         Args:
             event: Watchdog event object.
         """
-        logger.debug(f"Received watchdog event: {event}")
+        logger.debug("Received watchdog event: %s", event)
+        if event.is_directory:
+            return
+        self._queue_request(event.src_path)
+
+    def on_moved(self, event):
+        """
+        Handle rename events; requests are written to a temporary file and renamed into place.
+        Args:
+            event: Watchdog event object.
+        """
+        logger.debug("Received watchdog event: %s", event)
         if event.is_directory:
             return
-        file_path = Path(event.src_path)
-        if file_path.name.startswith(FILECLIP_REQUEST_PREFIX) and file_path.suffix == ".json":
-            logger.debug(f"Detected new request file: {file_path}")
-            process_file(file_path, self.shared_dir)
+        self._queue_request(event.dest_path)
+
+    def stop(self):
+        """Process the requests already queued, then end the worker thread."""
+        self.q.put(None)  # Sentinel: queued after every pending request
+        self.worker.join()
+
+    def _queue_request(self, file_path: str):
+        """Queue file_path for the worker if it is a request file."""
+        # Filter on the raw event string; a Path is only built for files that match
+        if REQUEST_FILE_RE.match(os.path.basename(file_path)):
+            logger.debug("Detected new request file: %s", file_path)
+            self.q.put(Path(file_path))
         else:
-            logger.debug(f"Ignored file: {file_path}")
+            logger.debug("Ignored file: %s", file_path)
+
+    def _drain(self):
+        """Worker loop: collect request files for batch_window after the first one and process them as one batch."""
+        while True:
+            items = [self.q.get()]
+            deadline = time.monotonic() + self.batch_window
+            try:
+                while items[-1] is not None:
+                    items.append(self.q.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            requests = [item for item in items if item is not None]
+            pending = []
+            try:
+                pending = self._pending_requests(requests) if requests else []
+                if pending:
+                    self.stuck.update(process_batch(pending, self.shared_dir))
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Failed to process batch: %s", e)
+                # Don't feed the batch's leftover files to every later sweep
+                self.stuck.update(path for path in pending if path.exists())
+            finally:
+                for _ in items:
+                    self.q.task_done()
+            if len(requests) < len(items):  # stop() was called
+                return
+
+    def _pending_requests(self, items: List[Path]) -> List[Path]:
+        """
+        List every request file now in shared_dir, oldest first. This also picks up requests whose
+        events were missed or have not arrived yet, and drops queued files that are already handled,
+        including ones that were handled but could not be deleted.
+        Args:
+            items: Request files reported by events, used as-is if shared_dir cannot be listed.
+        Returns:
+            List[Path]: Request files to process.
+        """
+        pending = []
+        try:
+            with os.scandir(self.shared_dir) as entries:
+                for entry in entries:
+                    if REQUEST_FILE_RE.match(entry.name):
+                        try:
+                            pending.append((entry.stat().st_mtime, Path(entry.path)))
+                        except FileNotFoundError:
+                            pass
+        except OSError as e:
+            logger.error("Failed to list %s: %s", self.shared_dir, e)
+            return [path for path in dict.fromkeys(items) if path not in self.stuck]
+        self.stuck.intersection_update(path for _, path in pending)  # Forget files that are gone at last
+        return [path for _, path in sorted(pending) if path not in self.stuck]
+
+def _select_observer(shared_dir: Path):
+    """
+    Choose the watchdog observer for shared_dir (internal).
+    Args:
+        shared_dir: Directory to monitor.
+    Returns:
+        Native Observer, or PollingObserver on network/VM-shared mounts or when FILECLIP_FORCE_POLLING is set.
+    """
+    if use_polling(shared_dir):
+        return PollingObserver(timeout=POLL_INTERVAL)
+    return Observer()
+
+def _install_signal_handlers(stop_event: threading.Event) -> dict:
+    """
+    Make SIGINT and SIGTERM set stop_event instead of raising in the main thread.
+    Args:
+        stop_event: Event to set when a shutdown signal arrives.
+    Returns:
+        dict: Previous handlers by signal number, for restoring; empty outside the main thread,
+        where handlers cannot be installed.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return {}
+    previous_handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        previous_handlers[signum] = signal.signal(signum, lambda *_: stop_event.set())
+    return previous_handlers
+
+def _wait_for_shutdown(stop_event: threading.Event):
+    """
+    Block until stop_event is set, without waking while idle.
+    Args:
+        stop_event: Event set by the shutdown signal handlers.
+    """
+    if sys.platform == "win32":
+        # Lock waits cannot be interrupted by Ctrl+C on Windows, so wake now and then to let the handler run
+        while not stop_event.wait(WINDOWS_SIGNAL_CHECK_INTERVAL):
+            pass
+    else:
+        stop_event.wait()
 
 def main():
     """Main function to run the fileclip watcher."""
@@ -174,25 +456,35 @@ def main():
     args = parser.parse_args()
 
     host_workspace = os.getenv("FILECLIP_HOST_WORKSPACE", "C:\\Temp\\fileclip")
-    shared_dir = Path(host_workspace) / ".fileclip"
+    shared_dir = get_shared_dir(host_workspace)
     log_file = shared_dir / "fileclip_watcher.log"
 
     setup_logging(log_file, args.log_level)
-    logger.info(f"Starting fileclip-watcher, monitoring {shared_dir}")
+    logger.info("Starting fileclip-watcher, monitoring %s", shared_dir)
 
-    observer = PollingObserver(timeout=.1)
-    observer.schedule(FileclipHandler(shared_dir), str(shared_dir), recursive=False)
-    observer.start()
-    logger.debug("PollingObserver started")
+    observer = _select_observer(shared_dir)
+    # The watcher copies many times over its life, so keep one PowerShell around instead of starting one per copy
+    enable_persistent_shell()
+    handler = FileclipHandler(shared_dir)
+    observer.schedule(handler, str(shared_dir), recursive=False, event_filter=IPC_EVENT_FILTER)
 
+    stop_event = threading.Event()
+    previous_handlers = _install_signal_handlers(stop_event)
     try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.info("Received shutdown signal")
-        observer.stop()
+        observer.start()
+        logger.debug("%s started", observer.__class__.__name__)
+        _wait_for_shutdown(stop_event)
+    except KeyboardInterrupt:  # Without our handlers (not the main thread), Ctrl+C still arrives this way
+        pass
+    finally:
+        for signum, previous in previous_handlers.items():
+            signal.signal(signum, previous)
+    logger.info("Received shutdown signal")
+    observer.stop()
 
     observer.join()
+    handler.stop()  # Finish any requests already queued
+    stop_logging()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,13 +1,45 @@
 import argparse
 import os
+import stat
 import sys
 from pathlib import Path
-from typing import List
-from fileclip.file_clip import copy_files, is_container
+from typing import Iterator, List, Optional
+from fileclip.file_clip import copy_files, get_shared_dir, is_container, map_paths
+
+def _iter_files(root: str) -> Iterator[str]:
+    """
+    Yield every file under root, walking with os.scandir so entry types come from the directory
+    listing instead of a stat per entry. Like rglob, symlinked directories are not descended into;
+    symlinked files are yielded, and directories that cannot be listed are skipped.
+    Args:
+        root: Directory to walk.
+    Returns:
+        Iterator of file paths under root.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:  # e.g. PermissionError; rglob skips unreadable directories too
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+def _stat_mode(path: str) -> Optional[int]:
+    """Return the st_mode of path, or None if it cannot be stat'ed (internal)."""
+    try:
+        return os.stat(path).st_mode
+    except OSError:
+        return None
 
 def collect_files(paths: List[str]) -> List[str]:
     """
     Collect all files from the given paths, expanding directories.
+    Paths are made absolute but symlinks are kept as given; copy_files resolves them when it validates.
     Args:
         paths: List of file or directory paths.
     Returns:
@@ -16,16 +48,13 @@ def collect_files(paths: List[str]) -> List[str]:
         FileNotFoundError: If a path does not exist.
     """
     files = []
-    for path in paths:
-        path = Path(path)
-        if not path.exists():
-            raise FileNotFoundError(f"Path {path} does not exist")
-        if path.is_file():
-            files.append(str(path.resolve()))
-        elif path.is_dir():
-            for item in path.rglob("*"):
-                if item.is_file():
-                    files.append(str(item.resolve()))
+    for path, mode in zip(paths, map_paths(_stat_mode, paths)):
+        if mode is None:
+            raise FileNotFoundError(f"Path {Path(path)} does not exist")
+        if stat.S_ISREG(mode):
+            files.append(os.path.abspath(path))
+        elif stat.S_ISDIR(mode):
+            files.extend(_iter_files(os.path.abspath(path)))
     return files
 
 def main():
@@ -46,8 +75,7 @@ def main():
         sys.exit(1)
 
     # Create .fileclip directory
-    container_workspace = os.getenv("FILECLIP_CONTAINER_WORKSPACE")
-    shared_dir = Path(container_workspace) / ".fileclip" if container_workspace else Path("/tmp/fileclip/.fileclip")
+    shared_dir = get_shared_dir(os.getenv("FILECLIP_CONTAINER_WORKSPACE"))
     shared_dir.mkdir(parents=True, exist_ok=True)
 
     try:
@@ -0,0 +1,88 @@
+import logging
+import os
+import subprocess
+import time
+
+import pytest
+
+from fileclip.file_clip import is_container
+
+
+# Clear the cached container detection so each test, in every module, sees its own patches and environment
+@pytest.fixture(autouse=True)
+def clear_is_container_cache():
+    is_container.cache_clear()
+    yield
+    is_container.cache_clear()
+
+def _wait_until(predicate, timeout=30, interval=0.05):
+    """Poll predicate until it returns True or timeout seconds pass; return whether it did."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+# Wait on the real completion signal (a file appearing, a log line) instead of sleeping for a fixed time
+@pytest.fixture(scope="session")
+def wait_until():
+    return _wait_until
+
+# Restore the root logger's handlers and level after each test, so logging set up by one test cannot leak into the next
+@pytest.fixture(autouse=True)
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+# Fail any test that would spawn a real clipboard tool; tests opt in by patching subprocess themselves
+@pytest.fixture(scope="session", autouse=True)
+def _block_real_subprocess():
+    def refuse(*args, **kwargs):
+        # pytest.fail raises a BaseException, so copy_files' own error handling cannot swallow it
+        pytest.fail(f"Test tried to run a real subprocess: {args[0] if args else kwargs.get('args')}")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(subprocess, "run", refuse)
+        mp.setattr(subprocess, "Popen", refuse)
+        yield
+
+# Session-wide workspace holding the read-only test corpus; tests that write get their own tmp_path
+@pytest.fixture(scope="session")
+def container_workspace(tmp_path_factory):
+    """Create the container workspace shared by all tests."""
+    return tmp_path_factory.mktemp("session") / "container_workspace"
+
+# Fixture for temporary files under container_workspace
+@pytest.fixture(scope="session")
+def temp_files(container_workspace):
+    """Create temporary files for testing, including one with special characters (once per session)."""
+    container_workspace.mkdir(parents=True, exist_ok=True)
+    file1 = container_workspace / "test1.txt"
+    file2 = container_workspace / "test2.pdf"
+    file3 = container_workspace / "test file@3.txt"  # Special characters
+    file1.touch()
+    file2.touch()
+    file3.touch()
+    return (str(file1), str(file2), str(file3))  # Tuple, so no test can change the shared corpus
+
+# The corpus files as the uri-list lines _copy_linux hands to wl-copy/xclip (tmp_path_factory paths are already absolute)
+@pytest.fixture(scope="session")
+def temp_files_uris(temp_files):
+    return tuple(b"file://" + os.fsencode(f) for f in temp_files)
+
+# Fixture for temporary directory with files under container_workspace
+@pytest.fixture(scope="session")
+def temp_dir_with_files(container_workspace):
+    """Create a temporary directory with files under container_workspace (once per session)."""
+    dir_path = container_workspace / "test_dir"
+    dir_path.mkdir(parents=True)
+    file1 = dir_path / "file1.txt"
+    file2 = dir_path / "file2.pdf"
+    file3 = dir_path / "file#3.txt"  # Special characters
+    file1.touch()
+    file2.touch()
+    file3.touch()
+    return str(dir_path), (str(file1), str(file2), str(file3))
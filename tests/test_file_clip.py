@@ -1,69 +1,59 @@
 import os
 import sys
+import copy
+import base64
+import re
 import json
-import uuid
 import time
+import threading
 import pytest
 import subprocess
+import fileclip.file_clip as file_clip
+import fileclip.main as fileclip_main
 from unittest.mock import patch, MagicMock
 from pathlib import Path
-from fileclip.file_clip import copy_files, is_container, translate_path, validate_path, check_watcher, write_fileclip_json, wait_for_results, _copy_files_direct
+from fileclip.file_clip import copy_files, is_container, get_shared_dir, translate_path, validate_path, check_watcher, write_fileclip_json, wait_for_results, write_json_atomic, read_json, try_unlink, is_network_fs, use_polling, _copy_files_direct
 from fileclip.main import main, collect_files
 
-# Mock subprocess.run to avoid actual clipboard changes during tests
-@pytest.fixture
-def mock_subprocess_run():
+# Successful clipboard command, built once; each test gets a shallow copy of it
+_OK_PROCESS = subprocess.CompletedProcess(args=["mock"], returncode=0, stdout="", stderr="")
+
+# copy_files' message for a missing path or a non-file, shared by the tests that expect it
+FILE_NOT_FOUND_RE = re.compile("File not found or not a file")
+
+# The command carried base64-encoded in a line written to the persistent PowerShell
+def decode_powershell_line(line):
+    encoded = re.search(r"FromBase64String\('([^']*)'\)", line).group(1)
+    return base64.b64decode(encoded).decode("utf-16-le")
+
+# Mock subprocess.run for the whole module to avoid actual clipboard changes during tests
+@pytest.fixture(scope="module", autouse=True)
+def _subprocess_run_patch():
     with patch("subprocess.run") as mock_run:
-        mock_run.return_value = subprocess.CompletedProcess(
-            args=["mock"], returncode=0, stdout="", stderr=""
-        )
         yield mock_run
 
-# Fixture for temporary files under container_workspace
+# Reset the module-wide subprocess.run mock for a test, instead of installing a new patch each time
 @pytest.fixture
-def temp_files(tmp_path):
-    """Create temporary files for testing, including one with special characters."""
-    container_workspace = tmp_path / "container_workspace"
-    container_workspace.mkdir(parents=True, exist_ok=True)
-    file1 = container_workspace / "test1.txt"
-    file2 = container_workspace / "test2.pdf"
-    file3 = container_workspace / "test file@3.txt"  # Special characters
-    file1.write_text("Hello, world!")
-    file2.write_text("Fake PDF content")
-    file3.write_text("Special char file")
-    return [str(file1), str(file2), str(file3)]
-
-# Fixture for temporary directory with files under container_workspace
-@pytest.fixture
-def temp_dir_with_files(tmp_path):
-    """Create a temporary directory with files under container_workspace."""
-    container_workspace = tmp_path / "container_workspace"
-    container_workspace.mkdir(parents=True, exist_ok=True)
-    dir_path = container_workspace / "test_dir"
-    dir_path.mkdir()
-    file1 = dir_path / "file1.txt"
-    file2 = dir_path / "file2.pdf"
-    file3 = dir_path / "file#3.txt"  # Special characters
-    file1.write_text("File 1 content")
-    file2.write_text("File 2 content")
-    file3.write_text("File 3 content")
-    return str(dir_path), [str(file1), str(file2), str(file3)]
+def mock_subprocess_run(_subprocess_run_patch):
+    _subprocess_run_patch.reset_mock(return_value=True, side_effect=True)
+    _subprocess_run_patch.return_value = copy.copy(_OK_PROCESS)
+    return _subprocess_run_patch
 
 # Fixture for mocking environment variables
 @pytest.fixture
-def mock_env(tmp_path):
+def mock_env(tmp_path, container_workspace, monkeypatch):
     """Mock environment variables for watcher and container testing."""
-    container_workspace = str(tmp_path / "container_workspace")
-    host_workspace = str(tmp_path / "host_workspace")
-    with patch.dict(os.environ, {
-        "FILECLIP_CONTAINER_WORKSPACE": container_workspace,
-        "FILECLIP_HOST_WORKSPACE": host_workspace,
-        "FILECLIP_USE_WATCHER": "true"
-    }):
-        yield {
-            "container_workspace": container_workspace,
-            "host_workspace": host_workspace
-        }
+    env = {
+        "container_workspace": str(container_workspace),
+        "host_workspace": str(tmp_path / "host_workspace"),
+        "shared_dir": str(tmp_path / ".fileclip"),  # Per test, so request files never leak between tests
+    }
+    # Set only the variables under test; monkeypatch undoes them without copying all of os.environ
+    monkeypatch.setenv("FILECLIP_CONTAINER_WORKSPACE", env["container_workspace"])
+    monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", env["host_workspace"])
+    monkeypatch.setenv("FILECLIP_SHARED_DIR", env["shared_dir"])
+    monkeypatch.setenv("FILECLIP_USE_WATCHER", "true")
+    return env
 
 # Fixture for mocking container environment
 @pytest.fixture
@@ -71,42 +61,114 @@ def mock_container():
     with patch("fileclip.file_clip.is_container", return_value=True):
         yield
 
-# Fixture for mocking watchdog observer
+# Fixture for running on a host, so the CLI copies directly even when the tests themselves run in a container
 @pytest.fixture
-def mock_watchdog_observer():
-    with patch("watchdog.observers.Observer") as mock_observer:
-        yield mock_observer
+def mock_host(monkeypatch):
+    monkeypatch.setattr(fileclip_main, "is_container", lambda: False)
+    monkeypatch.setattr(file_clip, "is_container", lambda: False)
 
-# Fixture for mocking file I/O
+# Fixture for a null watchdog observer; patched where file_clip looks it up, so no watch thread starts
 @pytest.fixture
-def mock_file_io():
-    with patch("builtins.open") as mock_open, patch("json.load") as mock_load, patch("json.dump") as mock_dump:
-        yield mock_open, mock_load, mock_dump
-
-# Test container detection
-def test_is_container_no_container():
-    """Test container detection when not in a container."""
-    with patch("pathlib.Path.exists", return_value=False), patch.dict(os.environ, {}, clear=True):
-        assert not is_container()
-
-def test_is_container_with_dockerenv():
-    """Test container detection with /.dockerenv."""
-    with patch("pathlib.Path.exists") as mock_exists, patch.dict(os.environ, {}, clear=True):
-        mock_exists.side_effect = [True, False]  # True for /.dockerenv, False for /vscode
-        assert is_container()
-        assert mock_exists.call_count == 1  # Only /.dockerenv checked due to short-circuit
+def mock_watchdog_observer(monkeypatch):
+    mock_observer = MagicMock()
+    monkeypatch.setattr(file_clip, "Observer", mock_observer)
+    monkeypatch.setattr(file_clip, "PollingObserver", mock_observer)
+    return mock_observer
+
+# Fixture for a Linux session with both Wayland and X11 displays, set and restored in one step;
+# tests using it change these two variables directly rather than through monkeypatch
+@pytest.fixture
+def linux_display_env():
+    with patch.dict(os.environ, {"WAYLAND_DISPLAY": "wayland-0", "DISPLAY": ":0"}):
+        yield
 
-def test_is_container_with_vscode():
-    """Test container detection with /vscode."""
-    with patch("pathlib.Path.exists") as mock_exists, patch.dict(os.environ, {}, clear=True):
-        mock_exists.side_effect = [False, True]  # False for /.dockerenv, True for /vscode
+# Fixture for a fake file system: copy_files treats only the paths added to the returned set as files
+@pytest.fixture
+def fake_fs(monkeypatch):
+    files = set()
+    def resolve(path):
+        abs_path = os.path.abspath(path)
+        return abs_path if abs_path in files else None
+    monkeypatch.setattr(file_clip, "_resolve_file", resolve)
+    return files
+
+# Fixture for a fake persistent PowerShell process that answers each command with the given line
+@pytest.fixture
+def mock_powershell(monkeypatch):
+    monkeypatch.setattr(file_clip, "_USE_PERSISTENT_SHELL", True)
+    monkeypatch.setattr(file_clip, "_PS_PROC", None)
+    read_fd, write_fd = os.pipe()
+    proc = MagicMock()
+    proc.poll.return_value = None
+    proc.stdout = os.fdopen(read_fd)
+    reply = {"line": "__FILECLIP_DONE__\n"}
+    proc.stdin.write.side_effect = lambda text: os.write(write_fd, reply["line"].encode())
+    with patch("subprocess.Popen", return_value=proc) as mock_popen:
+        yield mock_popen, proc, reply
+    os.close(write_fd)
+
+# Test container detection: (DEV_CONTAINER, Path.exists results for /.dockerenv and /vscode, expected, exists calls)
+@pytest.mark.parametrize("dev_container,exists,expected,exists_calls", [
+    pytest.param(None, [False, False], False, 2, id="no_container"),
+    pytest.param(None, [True], True, 1, id="dockerenv"),  # /vscode not checked due to short-circuit
+    pytest.param(None, [False, True], True, 2, id="vscode"),
+    pytest.param("true", [], True, 0, id="env"),
+])
+def test_is_container(dev_container, exists, expected, exists_calls, monkeypatch):
+    """Test container detection from DEV_CONTAINER, /.dockerenv and /vscode."""
+    if dev_container is None:
+        monkeypatch.delenv("DEV_CONTAINER", raising=False)
+    else:
+        monkeypatch.setenv("DEV_CONTAINER", dev_container)
+    with patch("pathlib.Path.exists", side_effect=exists) as mock_exists:
+        assert is_container() is expected
+    assert mock_exists.call_count == exists_calls
+
+def test_is_container_cached(monkeypatch):
+    """Test container detection is only computed once."""
+    monkeypatch.delenv("DEV_CONTAINER", raising=False)
+    with patch("pathlib.Path.exists", return_value=True) as mock_exists:
         assert is_container()
-        assert mock_exists.call_count == 2  # Both /.dockerenv and /vscode checked
-
-def test_is_container_with_env():
-    """Test container detection with DEV_CONTAINER env var."""
-    with patch.dict(os.environ, {"DEV_CONTAINER": "true"}), patch("pathlib.Path.exists", return_value=False):
         assert is_container()
+        assert mock_exists.call_count == 1
+
+def test_is_network_fs(tmp_path, monkeypatch):
+    """Test network filesystem detection from mountinfo."""
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(
+        "22 1 0:21 / / rw,relatime - overlay overlay rw\n"
+        "35 22 0:32 / /mounted/dev rw,relatime - 9p drvfs rw\n"
+        "36 22 0:33 / /mounted/dev/local rw,relatime - ext4 /dev/sda1 rw\n"
+    )
+    monkeypatch.setattr("fileclip.file_clip.MOUNTINFO_PATH", mountinfo)
+    assert is_network_fs("/mounted/dev/.fileclip")
+    assert not is_network_fs("/mounted/dev/local/.fileclip")
+    assert not is_network_fs("/tmp/.fileclip")
+
+def test_is_network_fs_no_mountinfo(tmp_path, monkeypatch):
+    """Test network filesystem detection when mountinfo is unavailable."""
+    monkeypatch.setattr("fileclip.file_clip.MOUNTINFO_PATH", tmp_path / "missing")
+    assert not is_network_fs("/mounted/dev/.fileclip")
+
+def test_use_polling(tmp_path, monkeypatch):
+    """Test use_polling honors FILECLIP_FORCE_POLLING and network filesystems."""
+    monkeypatch.delenv("FILECLIP_FORCE_POLLING", raising=False)
+    with patch("fileclip.file_clip.is_network_fs", return_value=False):
+        assert not use_polling(tmp_path)
+        monkeypatch.setenv("FILECLIP_FORCE_POLLING", "1")
+        assert use_polling(tmp_path)
+    monkeypatch.setenv("FILECLIP_FORCE_POLLING", "false")
+    with patch("fileclip.file_clip.is_network_fs", return_value=True):
+        assert use_polling(tmp_path)
+
+# Test shared directory selection
+def test_get_shared_dir(tmp_path, monkeypatch):
+    """Test get_shared_dir prefers FILECLIP_SHARED_DIR, then the workspace, then the /tmp default."""
+    monkeypatch.delenv("FILECLIP_SHARED_DIR", raising=False)
+    assert get_shared_dir(str(tmp_path)) == tmp_path / ".fileclip"
+    assert get_shared_dir(None) == Path("/tmp/fileclip/.fileclip")
+    monkeypatch.setenv("FILECLIP_SHARED_DIR", str(tmp_path / "ipc"))
+    assert get_shared_dir(str(tmp_path)) == tmp_path / "ipc"
 
 # Test path translation
 def test_translate_path(mock_env):
@@ -140,6 +202,15 @@ def test_validate_path(mock_env):
     assert validate_path(f"{env['container_workspace']}/test.txt", env['container_workspace'])
     assert not validate_path(str(Path(env['container_workspace']).parent / "other/test.txt"), env['container_workspace'])
 
+def test_validate_and_translate_resolved_paths():
+    """Test validate_path and translate_path skip resolution for already-resolved paths."""
+    with patch("pathlib.Path.resolve") as mock_resolve:
+        assert validate_path("/mounted/dev/test.txt", "/mounted/dev", _resolved=True)
+        assert not validate_path("/other/test.txt", "/mounted/dev", _resolved=True)
+        result = translate_path("/mounted/dev/sub/test.txt", "/mounted/dev", "/host/dev", _resolved=True)
+        mock_resolve.assert_not_called()
+    assert result == os.path.join("/host/dev", "sub/test.txt")
+
 # Test write_fileclip_json
 def test_write_fileclip_json(tmp_path):
     """Test writing fileclip_request_<uuid>.json."""
@@ -149,13 +220,92 @@ def test_write_fileclip_json(tmp_path):
     with patch("socket.gethostname", return_value="test-host"), patch("os.getpid", return_value=1234):
         request_id, json_file = write_fileclip_json(shared_dir, paths, "unused_sender")
         assert json_file.exists()
-        with open(json_file, "r") as f:
-            data = json.load(f)
+        data = read_json(json_file)  # orjson when installed, same as the watcher reading the request
         assert data["action"] == "copy_files"
         assert data["sender"] == "container_test-host_1234"
         assert data["request_id"] == request_id
         assert data["paths"] == paths
 
+# Test write_json_atomic
+def test_write_json_atomic(tmp_path):
+    """Test write_json_atomic writes the final file and leaves no temporary file behind."""
+    json_file = tmp_path / "fileclip_request_test-uuid.json"
+    write_json_atomic(json_file, {"action": "ping"})
+    assert json.loads(json_file.read_text()) == {"action": "ping"}
+    assert not list(tmp_path.glob("*.tmp"))
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_read_json_roundtrip(tmp_path, monkeypatch, use_orjson):
+    """Test read_json and write_json_atomic with and without orjson."""
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(file_clip, "orjson", None)
+    json_file = tmp_path / "fileclip_results_test-uuid.json"
+    data = {"success": True, "message": "Copied 1 file(s)", "errors": [], "path": "C:\\dev\\fïle.txt"}
+    write_json_atomic(json_file, data)
+    assert read_json(json_file) == data
+    json_file.write_text("{not json")
+    with pytest.raises(json.JSONDecodeError):
+        read_json(json_file)
+
+# Test try_unlink
+def test_try_unlink(tmp_path):
+    """Test try_unlink deletes a file and ignores one that is already gone."""
+    path = tmp_path / "fileclip_results_test-uuid.json"
+    path.write_text("{}")
+    try_unlink(path)
+    assert not path.exists()
+    try_unlink(path)  # Already gone: no error
+
+def test_write_json_atomic_short_writes(tmp_path):
+    """Test write_json_atomic finishes the file when the OS accepts only part of each write."""
+    json_file = tmp_path / "fileclip_request_test-uuid.json"
+    real_write = os.write
+    with patch("os.write", side_effect=lambda fd, data: real_write(fd, bytes(data[:3]))) as mock_write:
+        write_json_atomic(json_file, {"action": "ping", "request_id": "test-uuid"})
+    assert mock_write.call_count > 1
+    assert json.loads(json_file.read_text()) == {"action": "ping", "request_id": "test-uuid"}
+
+def test_write_json_atomic_error(tmp_path, monkeypatch):
+    """Test write_json_atomic removes the temporary file when the rename fails."""
+    monkeypatch.setattr(file_clip, "O_TMPFILE", None)
+    json_file = tmp_path / "fileclip_request_test-uuid.json"
+    with patch("os.replace", side_effect=OSError("Read-only")):
+        with pytest.raises(OSError, match="Read-only"):
+            write_json_atomic(json_file, {"action": "ping"})
+    assert not list(tmp_path.iterdir())
+
+def test_write_json_atomic_tmpfile(tmp_path):
+    """Test write_json_atomic links an O_TMPFILE into place without a named temporary file or rename."""
+    json_file = tmp_path / "fileclip_results_test-uuid.json"
+    if not file_clip._write_linked_tmpfile(tmp_path / "probe.json", b"{}"):
+        pytest.skip("O_TMPFILE linking is not supported here")
+    with patch("os.replace") as mock_replace:
+        write_json_atomic(json_file, {"success": True})
+    mock_replace.assert_not_called()
+    assert read_json(json_file) == {"success": True}
+
+def test_write_json_atomic_tmpfile_fallback(tmp_path, monkeypatch):
+    """Test write_json_atomic falls back to rename when the file exists or O_TMPFILE is unsupported."""
+    json_file = tmp_path / "fileclip_results_test-uuid.json"
+    json_file.write_text("{}")
+    write_json_atomic(json_file, {"success": True})  # link() never overwrites
+    assert read_json(json_file) == {"success": True}
+
+    monkeypatch.setattr(file_clip, "O_TMPFILE", 0o20000000)
+    monkeypatch.setattr(file_clip, "_NO_TMPFILE_DIRS", set())
+    real_open = os.open
+    def fake_open(path, flags, *args):
+        if flags & file_clip.O_TMPFILE:
+            raise OSError(file_clip.errno.EOPNOTSUPP, "Operation not supported")
+        return real_open(path, flags, *args)
+    with patch("os.open", side_effect=fake_open):
+        write_json_atomic(json_file, {"success": False})
+    assert read_json(json_file) == {"success": False}
+    assert file_clip._NO_TMPFILE_DIRS == {tmp_path}
+    assert not list(tmp_path.glob("*.tmp"))
+
 # Test check_watcher with no response
 def test_check_watcher_no_response(tmp_path):
     """Test check_watcher with no response."""
@@ -164,43 +314,106 @@ def test_check_watcher_no_response(tmp_path):
     assert not check_watcher(shared_dir, timeout=0.1)
     assert not list(shared_dir.glob("fileclip_request_*.json"))
 
+def test_check_watcher_response(tmp_path):
+    """Test check_watcher returns True once the watcher answers the ping, and removes the answer."""
+    shared_dir = tmp_path / ".fileclip"
+    results_dir = shared_dir / "results"
+
+    def answer_ping():
+        ping_file = next(shared_dir.glob("fileclip_request_*.json"))
+        request_id = json.loads(ping_file.read_text())["request_id"]
+        write_json_atomic(results_dir / f"fileclip_results_{request_id}.json", {"success": True, "message": "Ping acknowledged"})
+        ping_file.unlink()
+
+    timer = threading.Timer(0.2, answer_ping)
+    timer.start()
+    try:
+        assert check_watcher(shared_dir, timeout=5.0)
+    finally:
+        timer.cancel()
+    assert not list(shared_dir.glob("fileclip_request_*.json"))
+    assert not list(results_dir.iterdir())
+
 # Test wait_for_results with timeout
 def test_wait_for_results_timeout(tmp_path, mock_watchdog_observer):
     """Test wait_for_results with timeout."""
     shared_dir = tmp_path / ".fileclip"
     shared_dir.mkdir(parents=True, exist_ok=True)
     mock_observer_instance = mock_watchdog_observer.return_value
-    mock_observer_instance.start.return_value = None
-    mock_observer_instance.stop.return_value = None
-    mock_observer_instance.join.return_value = None
     result = wait_for_results(shared_dir, "test-uuid", timeout=0.1)
     assert result == {"success": False, "message": "Timeout waiting for results after 0.1s"}
+    mock_observer_instance.start.assert_called_once()
+    mock_observer_instance.stop.assert_called_once()
+    mock_observer_instance.join.assert_called_once()
+
+# Test wait_for_results when the result file already exists
+def test_wait_for_results_existing_file(tmp_path):
+    """Test wait_for_results returns a result written before the observer started."""
+    shared_dir = tmp_path / ".fileclip"
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    results_path = shared_dir / "results" / "fileclip_results_test-uuid.json"
+    results_path.parent.mkdir()
+    results_path.write_text(json.dumps({"success": True, "message": "Copied 1 file(s)"}))
+    result = wait_for_results(shared_dir, "test-uuid", timeout=5)
+    assert result == {"success": True, "message": "Copied 1 file(s)"}
+    assert not results_path.exists()
+
+# Test wait_for_results wakes up when the result file is written
+def test_wait_for_results_event(tmp_path):
+    """Test wait_for_results returns as soon as the watcher writes the result file."""
+    shared_dir = tmp_path / ".fileclip"
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    results_path = shared_dir / "results" / "fileclip_results_test-uuid.json"
+    results_path.parent.mkdir()
+    writer = threading.Timer(0.2, results_path.write_text, args=(json.dumps({"success": True, "message": "Copied"}),))
+    writer.start()
+    start = time.time()
+    result = wait_for_results(shared_dir, "test-uuid", timeout=10)
+    writer.join()
+    assert result == {"success": True, "message": "Copied"}
+    assert time.time() - start < 5
+    assert not results_path.exists()
+
+# Test wait_for_results picks up a result written where older watchers put it
+def test_wait_for_results_legacy_location(tmp_path):
+    """Test wait_for_results accepts a result in the shared directory itself, as written by older watchers."""
+    shared_dir = tmp_path / ".fileclip"
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    legacy_path = shared_dir / "fileclip_results_test-uuid.json"
+    writer = threading.Timer(0.2, legacy_path.write_text, args=(json.dumps({"success": True, "message": "Copied"}),))
+    writer.start()
+    start = time.time()
+    result = wait_for_results(shared_dir, "test-uuid", timeout=10)
+    writer.join()
+    assert result == {"success": True, "message": "Copied"}
+    assert time.time() - start < 5
+    assert not legacy_path.exists()
 
 # Test copy_files with valid files (direct mode)
-def test_copy_files_valid_files(temp_files, mock_subprocess_run, mock_env, monkeypatch):
+def test_copy_files_valid_files(temp_files, mock_subprocess_run, linux_display_env, mock_env):
     """Test copy_files with valid files in direct mode."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
     assert copy_files(temp_files, use_watcher=False)
     mock_subprocess_run.assert_called()
 
 # Test copy_files with invalid file
 def test_copy_files_invalid_file(mock_env):
     """Test copy_files with invalid file."""
-    with pytest.raises(FileNotFoundError, match="File not found or not a file"):
+    with pytest.raises(FileNotFoundError, match=FILE_NOT_FOUND_RE):
         copy_files(["nonexistent.txt"], use_watcher=False)
 
 # Test copy_files with empty list
-def test_copy_files_empty_list(mock_env):
-    """Test copy_files with empty list."""
-    assert not copy_files([], use_watcher=False)
+def test_copy_files_empty_list():
+    """Test copy_files with empty list returns before reading any configuration."""
+    with patch("os.getenv") as mock_getenv:
+        assert not copy_files([], use_watcher=False)
+    mock_getenv.assert_not_called()
 
 # Test copy_files with directory in list
-def test_copy_files_directory_in_list(temp_files, tmp_path, mock_env):
+def test_copy_files_directory_in_list(temp_files, temp_dir_with_files, mock_env):
     """Test copy_files with a directory."""
-    dir_path = tmp_path / "test_dir"
-    dir_path.mkdir()
-    invalid_files = temp_files + [str(dir_path)]
-    with pytest.raises(FileNotFoundError, match="File not found or not a file"):
+    dir_path, _ = temp_dir_with_files  # Reuse the corpus directory instead of creating one
+    invalid_files = [*temp_files, dir_path]
+    with pytest.raises(FileNotFoundError, match=FILE_NOT_FOUND_RE):
         copy_files(invalid_files, use_watcher=False)
 
 # Test copy_files on unsupported platform
@@ -210,48 +423,44 @@ def test_copy_files_unsupported_platform(temp_files, mock_env):
         with pytest.raises(RuntimeError, match="Unsupported platform: unsupported"):
             copy_files(temp_files, use_watcher=False)
 
+# Test platform dispatch
+@pytest.mark.parametrize("platform", ["win32", "darwin", "linux"])
+def test_copy_files_direct_dispatch(platform, monkeypatch):
+    """Test _copy_files_direct calls the implementation for the current platform."""
+    impl = MagicMock(return_value=True)
+    monkeypatch.setitem(file_clip.COPY_IMPLS, platform, impl)
+    monkeypatch.setattr(sys, "platform", platform)
+    assert _copy_files_direct(["/tmp/a.txt"]) is True
+    impl.assert_called_once_with(["/tmp/a.txt"])
+
 # Linux-specific tests (skipped on non-Linux)
 @pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
-def test_copy_files_linux_wlcopy_missing(temp_files, monkeypatch, mock_env):
+def test_copy_files_linux_wlcopy_missing(temp_files, mock_subprocess_run, linux_display_env, mock_env):
     """Test copy_files on Linux with wl-copy missing."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
-    monkeypatch.setenv("DISPLAY", ":0")
-    with patch("subprocess.run") as mock_run:
-        mock_run.side_effect = [
-            FileNotFoundError("wl-copy not found"),
-            subprocess.CompletedProcess(
-                args=["xclip", "-selection", "clipboard", "-t", "text/uri-list"],
-                returncode=0, stdout="", stderr=""
-            )
-        ]
-        result = copy_files(temp_files, use_watcher=False)
-        assert result is True
-        assert mock_run.call_count == 2
-        assert mock_run.call_args_list[0][0][0][0] == "wl-copy"
-        assert mock_run.call_args_list[1][0][0][0] == "xclip"
-        assert mock_run.call_args_list[1][1]["input"].decode().startswith("file://")
+    mock_subprocess_run.side_effect = [FileNotFoundError("wl-copy not found"), copy.copy(_OK_PROCESS)]
+    result = copy_files(temp_files, use_watcher=False)
+    assert result is True
+    (wayland_args, _), (x11_args, x11_kwargs) = mock_subprocess_run.call_args_list
+    assert wayland_args[0][0] == "wl-copy"
+    assert x11_args[0][0] == "xclip"
+    assert x11_kwargs["input"].startswith(b"file://")
 
 @pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
-def test_copy_files_linux_xclip_missing(temp_files, monkeypatch, mock_env):
+def test_copy_files_linux_xclip_missing(temp_files, mock_subprocess_run, linux_display_env, mock_env):
     """Test copy_files on Linux when both wl-copy and xclip are missing."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
-    monkeypatch.setenv("DISPLAY", ":0")
-    with patch("subprocess.run") as mock_run:
-        mock_run.side_effect = [
-            FileNotFoundError("wl-copy not found"),
-            FileNotFoundError("xclip not found")
-        ]
-        with pytest.raises(RuntimeError, match="xclip not found"):
-            copy_files(temp_files, use_watcher=False)
-        assert mock_run.call_count == 2
-        assert mock_run.call_args_list[0][0][0][0] == "wl-copy"
-        assert mock_run.call_args_list[1][0][0][0] == "xclip"
+    mock_subprocess_run.side_effect = [
+        FileNotFoundError("wl-copy not found"),
+        FileNotFoundError("xclip not found")
+    ]
+    with pytest.raises(RuntimeError, match="xclip not found"):
+        copy_files(temp_files, use_watcher=False)
+    (wayland_args, _), (x11_args, _) = mock_subprocess_run.call_args_list
+    assert wayland_args[0][0] == "wl-copy"
+    assert x11_args[0][0] == "xclip"
 
 @pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
-def test_copy_files_linux_timeout(temp_files, mock_subprocess_run, monkeypatch, capsys, mock_env):
+def test_copy_files_linux_timeout(temp_files, temp_files_uris, mock_subprocess_run, capsys, linux_display_env, mock_env):
     """Test copy_files on Linux when both clipboard operations time out."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
-    monkeypatch.setenv("DISPLAY", ":0")
     mock_subprocess_run.side_effect = [
         subprocess.TimeoutExpired(
             cmd=["wl-copy", "--type", "text/uri-list"],
@@ -269,10 +478,37 @@ def test_copy_files_linux_timeout(temp_files, mock_subprocess_run, monkeypatch,
     assert "X11 clipboard operation timed out" in captured.out
     assert "No functional display server detected" in captured.out
     assert "File URIs (copy manually):" in captured.out
-    assert all(f"file://{os.path.abspath(f)}" in captured.out for f in temp_files)
+    assert all(os.fsdecode(uri) in captured.out for uri in temp_files_uris)
 
 @pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
-def test_copy_files_linux_no_display(temp_files, monkeypatch, capsys, mock_env):
+def test_copy_files_linux_env(temp_files, mock_subprocess_run, monkeypatch, linux_display_env, mock_env):
+    """Test that the environment is only rebuilt when XDG_RUNTIME_DIR is missing."""
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    copy_files(temp_files, use_watcher=False)
+    assert mock_subprocess_run.call_args[1]["env"] is None
+
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    copy_files(temp_files, use_watcher=False)
+    env = mock_subprocess_run.call_args[1]["env"]
+    assert env["XDG_RUNTIME_DIR"] == f"/run/user/{os.getuid()}"
+    assert env["WAYLAND_DISPLAY"] == "wayland-0"
+    assert "XDG_RUNTIME_DIR" not in os.environ
+
+@pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
+@pytest.mark.parametrize("use_wayland", [True, False], ids=["wayland", "x11"])
+def test_copy_files_linux_uri_list_bytes(use_wayland, temp_files, temp_files_uris, mock_subprocess_run, linux_display_env, mock_env):
+    """Test the uri-list is passed to wl-copy or xclip as bytes, one URI per line."""
+    if not use_wayland:
+        del os.environ["WAYLAND_DISPLAY"]  # linux_display_env restores it
+    assert copy_files(temp_files, use_watcher=False) is True
+    (cmd, *_), kwargs = mock_subprocess_run.call_args
+    assert cmd[0] == ("wl-copy" if use_wayland else "xclip")
+    uri_list = kwargs["input"]
+    assert isinstance(uri_list, bytes)
+    assert uri_list == b"\n".join(temp_files_uris)
+
+@pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
+def test_copy_files_linux_no_display(temp_files, temp_files_uris, monkeypatch, capsys, mock_env):
     """Test copy_files on Linux with no display server."""
     monkeypatch.delenv("WAYLAND_DISPLAY", raising=False)
     monkeypatch.delenv("DISPLAY", raising=False)
@@ -281,223 +517,231 @@ def test_copy_files_linux_no_display(temp_files, monkeypatch, capsys, mock_env):
     captured = capsys.readouterr()
     assert "No functional display server detected" in captured.out
     assert "File URIs (copy manually):" in captured.out
-    assert all(f"file://{os.path.abspath(f)}" in captured.out for f in temp_files)
-
-@pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
-def test_copy_files_linux_wlcopy_subprocess_error(temp_files, mock_subprocess_run, monkeypatch, mock_env):
-    """Test copy_files with a subprocess error on Wayland."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        returncode=1,
-        cmd=["wl-copy", "--type", "text/uri-list"],
-        stderr=b"Wayland error"
-    )
-    with pytest.raises(RuntimeError, match="Wayland clipboard error: Wayland error"):
-        copy_files(temp_files, use_watcher=False)
-
-@pytest.mark.skipif(sys.platform != "linux", reason="Linux-specific test")
-def test_copy_files_linux_xclip_subprocess_error(temp_files, mock_subprocess_run, monkeypatch, mock_env):
-    """Test copy_files with a subprocess error on X11."""
-    monkeypatch.delenv("WAYLAND_DISPLAY", raising=False)
-    monkeypatch.setenv("DISPLAY", ":0")
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        returncode=1,
-        cmd=["xclip", "-selection", "clipboard", "-t", "text/uri-list"],
-        stderr=b"X11 error"
-    )
-    with pytest.raises(RuntimeError, match="X11 clipboard error: X11 error"):
-        copy_files(temp_files, use_watcher=False)
-
-@pytest.mark.skipif(sys.platform != "darwin", reason="macOS-specific test")
-def test_copy_files_macos_subprocess_error(temp_files, mock_subprocess_run, mock_env):
-    """Test copy_files with a subprocess error on macOS."""
-    cmd = 'osascript -e \'tell app "Finder" to set the clipboard to {'
-    cmd += ', '.join(f'POSIX file "{p}"' for p in temp_files)
-    cmd += '}\''
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        returncode=1,
-        cmd=cmd,
-        stderr="macOS error"
-    )
-    with pytest.raises(RuntimeError, match="macOS clipboard error: macOS error"):
+    assert all(os.fsdecode(uri) in captured.out for uri in temp_files_uris)
+
+# (platform, environment changes, stderr from the clipboard tool, expected error)
+SUBPROCESS_ERROR_CASES = [
+    pytest.param("linux", {"WAYLAND_DISPLAY": "wayland-0", "XDG_RUNTIME_DIR": "/run/user/1000"}, b"Wayland error",
+                 "Wayland clipboard error: Wayland error", id="wayland"),
+    pytest.param("linux", {"WAYLAND_DISPLAY": None, "DISPLAY": ":0", "XDG_RUNTIME_DIR": "/run/user/1000"}, b"X11 error",
+                 "X11 clipboard error: X11 error", id="x11"),
+    pytest.param("darwin", {}, "macOS error", "AppleScript failed: macOS error", id="macos"),
+    pytest.param("win32", {}, "Windows error", "Windows clipboard error: Windows error", id="windows"),
+]
+
+@pytest.mark.parametrize("platform,env,stderr,message", SUBPROCESS_ERROR_CASES)
+def test_copy_files_subprocess_error(platform, env, stderr, message, temp_files, mock_subprocess_run, monkeypatch, mock_env):
+    """Test copy_files raises the platform's clipboard error when the clipboard tool fails."""
+    monkeypatch.setattr(sys, "platform", platform)
+    for name, value in env.items():
+        if value is None:
+            monkeypatch.delenv(name, raising=False)
+        else:
+            monkeypatch.setenv(name, value)
+    mock_subprocess_run.side_effect = subprocess.CalledProcessError(returncode=1, cmd=["mock"], stderr=stderr)
+    with pytest.raises(RuntimeError, match=message):
         copy_files(temp_files, use_watcher=False)
 
-@pytest.mark.skipif(sys.platform != "win32", reason="Windows-specific test")
-def test_copy_files_windows_subprocess_error(temp_files, mock_subprocess_run, mock_env):
-    """Test copy_files with a subprocess error on Windows."""
-    paths = ','.join(f'"{p}"' for p in temp_files)
-    cmd = f'powershell.exe -Command "Set-Clipboard -Path {paths}"'
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        returncode=1,
-        cmd=cmd,
-        stderr="Windows error"
-    )
-    with pytest.raises(RuntimeError, match="Windows clipboard error: Windows error"):
-        copy_files(temp_files, use_watcher=False)
-
-def test_copy_files_large_number_of_files(tmp_path, mock_subprocess_run, monkeypatch, mock_env):
+def test_copy_files_large_number_of_files(mock_subprocess_run, fake_fs, linux_display_env, mock_env):
     """Test copy_files with a large number of files."""
-    container_workspace = tmp_path / "container_workspace"
-    container_workspace.mkdir(parents=True, exist_ok=True)
-    files = [str(container_workspace / f"file{i}.txt") for i in range(100)]
-    for f in files:
-        Path(f).write_text("Test content")
-    if sys.platform == "linux":
-        monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
+    # Synthesized paths are never created; test_copy_files_valid_files covers real files
+    files = [os.path.abspath(f"/fake/cw/file{i}.txt") for i in range(100)]
+    fake_fs.update(files)
+    with pytest.raises(FileNotFoundError, match="missing.txt"):
+        copy_files([*files, "/fake/cw/missing.txt"], use_watcher=False)
     result = copy_files(files, use_watcher=False)
     assert result is True
     mock_subprocess_run.assert_called_once()
     if sys.platform == "linux":
-        assert mock_subprocess_run.call_args[1]["input"].decode().startswith("file://")
+        assert mock_subprocess_run.call_args[1]["input"].startswith(b"file://")
 
-def test_cli_valid_files(temp_files, capsys, monkeypatch, mock_subprocess_run, mock_env):
+def test_cli_valid_files(temp_files, mock_host, capsys, monkeypatch, mock_subprocess_run, linux_display_env, mock_env):
     """Test CLI with valid files."""
-    if sys.platform == "linux":
-        monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
-    monkeypatch.setattr(sys, "argv", ["fileclip"] + temp_files)
+    monkeypatch.setattr(sys, "argv", ["fileclip", *temp_files])
     main()
     captured = capsys.readouterr()
     assert "Files copied to clipboard" in captured.out
     mock_subprocess_run.assert_called_once()
     if sys.platform == "linux":
-        assert mock_subprocess_run.call_args[1]["input"].decode().startswith("file://")
+        assert mock_subprocess_run.call_args[1]["input"].startswith(b"file://")
 
-def test_cli_directory(temp_dir_with_files, capsys, monkeypatch, mock_subprocess_run, mock_env):
+def test_cli_directory(temp_dir_with_files, mock_host, capsys, monkeypatch, mock_subprocess_run, linux_display_env, mock_env):
     """Test CLI with a directory path."""
-    if sys.platform == "linux":
-        monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
     dir_path, expected_files = temp_dir_with_files
     monkeypatch.setattr(sys, "argv", ["fileclip", dir_path])
     main()
     captured = capsys.readouterr()
     assert "Files copied to clipboard" in captured.out
     mock_subprocess_run.assert_called_once()
-    called_args = mock_subprocess_run.call_args[0][0]
+    (called_args, *_), kwargs = mock_subprocess_run.call_args
+    abs_paths = expected_files  # tmp_path_factory paths are already absolute
     if sys.platform == "linux":
         assert called_args[0] in ["wl-copy", "xclip"]
-        assert all(f"file://{os.path.abspath(f)}" in mock_subprocess_run.call_args[1]["input"].decode() for f in expected_files)
+        # One URI per line: compare as sets instead of searching the decoded list once per file
+        uris = set(kwargs["input"].split(b"\n"))
+        assert {b"file://" + os.fsencode(p) for p in abs_paths} <= uris
     elif sys.platform == "darwin":
         assert called_args.startswith("osascript")
-        assert all(os.path.abspath(f) in called_args for f in expected_files)
+        assert all(p in called_args for p in abs_paths)
     elif sys.platform == "win32":
         assert "powershell.exe" in called_args
-        assert all(os.path.abspath(f) in called_args for f in expected_files)
+        assert all(p in called_args for p in abs_paths)
 
-def test_cli_mixed_files_and_directory(temp_files, temp_dir_with_files, capsys, monkeypatch, mock_subprocess_run, mock_env):
+def test_cli_mixed_files_and_directory(temp_files, temp_dir_with_files, mock_host, capsys, monkeypatch, mock_subprocess_run, linux_display_env, mock_env):
     """Test CLI with a mix of file and directory paths."""
-    if sys.platform == "linux":
-        monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
     dir_path, dir_files = temp_dir_with_files
-    mixed_paths = temp_files + [dir_path]
+    mixed_paths = [*temp_files, dir_path]
     monkeypatch.setattr(sys, "argv", ["fileclip"] + mixed_paths)
     main()
     captured = capsys.readouterr()
     assert "Files copied to clipboard" in captured.out
     mock_subprocess_run.assert_called_once()
-    called_args = mock_subprocess_run.call_args[0][0]
+    (called_args, *_), kwargs = mock_subprocess_run.call_args
+    abs_paths = temp_files + dir_files  # tmp_path_factory paths are already absolute
     if sys.platform == "linux":
         assert called_args[0] in ["wl-copy", "xclip"]
-        assert all(f"file://{os.path.abspath(f)}" in mock_subprocess_run.call_args[1]["input"].decode() for f in temp_files + dir_files)
+        # One URI per line: compare as sets instead of searching the decoded list once per file
+        uris = set(kwargs["input"].split(b"\n"))
+        assert {b"file://" + os.fsencode(p) for p in abs_paths} <= uris
     elif sys.platform == "darwin":
         assert called_args.startswith("osascript")
-        assert all(os.path.abspath(f) in called_args for f in temp_files + dir_files)
+        assert all(p in called_args for p in abs_paths)
     elif sys.platform == "win32":
         assert "powershell.exe" in called_args
-        assert all(os.path.abspath(f) in called_args for f in temp_files + dir_files)
+        assert all(p in called_args for p in abs_paths)
 
 def test_cli_no_paths(capsys, monkeypatch):
     """Test CLI with no paths."""
     monkeypatch.setattr(sys, "argv", ["fileclip"])
-    with pytest.raises(SystemExit):
+    with pytest.raises(SystemExit) as exc_info:
         main()
-    captured = capsys.readouterr()
-    assert "Error: No files specified or found in provided paths" in captured.err
+    assert exc_info.value.code == 1
+    assert "Error: No files specified or found in provided paths" in capsys.readouterr().err
 
 def test_cli_invalid_path(capsys, monkeypatch):
     """Test CLI with an invalid path."""
     monkeypatch.setattr(sys, "argv", ["fileclip", "nonexistent_path"])
-    with pytest.raises(SystemExit):
+    with pytest.raises(SystemExit) as exc_info:
         main()
-    captured = capsys.readouterr()
-    assert "Error: Path nonexistent_path does not exist" in captured.err
+    assert exc_info.value.code == 1
+    assert "Error: Path nonexistent_path does not exist" in capsys.readouterr().err
 
-def test_cli_copy_files_failure(temp_files, capsys, monkeypatch, mock_subprocess_run, mock_env):
+def test_cli_copy_files_failure(temp_files, mock_host, capsys, monkeypatch, mock_subprocess_run, linux_display_env, mock_env):
     """Test CLI when copy_files fails."""
-    if sys.platform == "linux":
-        monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
     mock_subprocess_run.side_effect = RuntimeError("Test error")
-    monkeypatch.setattr(sys, "argv", ["fileclip"] + temp_files)
+    monkeypatch.setattr(sys, "argv", ["fileclip", *temp_files])
     with pytest.raises(SystemExit):
         main()
     captured = capsys.readouterr()
     assert "Failed to copy files: Test error" in captured.err
 
-def test_copy_files_linux_mocked(temp_files, mock_subprocess_run, monkeypatch, mock_env):
-    """Test copy_files on Linux by mocking platform."""
-    monkeypatch.setattr(sys, "platform", "linux")
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
+@pytest.mark.parametrize("platform, expected_cmds, path_format", [
+    ("linux", ("wl-copy", "xclip"), None),
+    ("darwin", ("osascript",), "{}"),
+    ("win32", ("powershell.exe",), "'{}'"),
+])
+def test_copy_files_platform_mocked(platform, expected_cmds, path_format, temp_files, mock_subprocess_run, monkeypatch, linux_display_env, mock_env):
+    """Test copy_files builds each platform's clipboard command by mocking platform."""
+    monkeypatch.setattr(sys, "platform", platform)
     result = copy_files(temp_files, use_watcher=False)
     assert result is True
     mock_subprocess_run.assert_called_once()
-    assert mock_subprocess_run.call_args[0][0][0] in ["wl-copy", "xclip"]
-    assert mock_subprocess_run.call_args[1]["input"].decode().startswith("file://")
+    (cmd, *_), kwargs = mock_subprocess_run.call_args
+    assert cmd[0] in expected_cmds
+    if path_format is None:
+        assert kwargs["input"].startswith(b"file://")
+    else:
+        assert "shell" not in kwargs
+        assert "env" not in kwargs
+        command = " ".join(cmd)
+        assert all(path_format.format(f) in command for f in temp_files)
+
+def test_copy_files_windows_quoting(tmp_path, mock_subprocess_run, mock_env):
+    """Test that Windows paths with quotes are passed as literal PowerShell strings."""
+    path = tmp_path / "it's \"quoted\" $(calc).txt"
+    path.write_text("content")
+    with patch("sys.platform", "win32"):
+        assert copy_files([path], use_watcher=False) is True
+    quoted = "'" + str(path).replace("'", "''") + "'"
+    assert mock_subprocess_run.call_args[0][0][-1] == f"Set-Clipboard -LiteralPath @({quoted})"
 
-def test_copy_files_macos_mocked(temp_files, mock_subprocess_run, monkeypatch, mock_env):
-    """Test copy_files on macOS by mocking platform."""
-    monkeypatch.setattr(sys, "platform", "darwin")
-    result = copy_files(temp_files, use_watcher=False)
-    assert result is True
-    mock_subprocess_run.assert_called_once()
-    assert mock_subprocess_run.call_args[0][0].startswith("osascript")
-    assert all(os.path.abspath(f) in mock_subprocess_run.call_args[0][0] for f in temp_files)
+def test_copy_files_windows_persistent_shell(temp_files, mock_subprocess_run, mock_powershell, mock_env):
+    """Test that Windows copies reuse one persistent PowerShell process."""
+    mock_popen, proc, _ = mock_powershell
+    with patch("sys.platform", "win32"):
+        assert copy_files(temp_files, use_watcher=False) is True
+        assert copy_files(temp_files[:1], use_watcher=False) is True
+    mock_popen.assert_called_once()
+    assert mock_popen.call_args[0][0][:2] == ["powershell.exe", "-NoProfile"]
+    assert proc.stdin.write.call_count == 2
+    command = decode_powershell_line(proc.stdin.write.call_args_list[0][0][0])
+    assert "Set-Clipboard -LiteralPath" in command
+    assert all(f in command for f in temp_files)
+    mock_subprocess_run.assert_not_called()
+
+def test_copy_files_windows_persistent_shell_unicode(tmp_path, mock_subprocess_run, mock_powershell, mock_env):
+    """Test that non-ASCII paths reach the persistent PowerShell intact, whatever its console code page."""
+    mock_popen, proc, reply = mock_powershell
+    path = tmp_path / "café 文件.txt"
+    path.write_text("content")
+    reply["line"] = "__FILECLIP_DONE__" + base64.b64encode(f"Cannot find path '{path}'".encode()).decode() + "\n"
+    with patch("sys.platform", "win32"):
+        with pytest.raises(RuntimeError, match=re.escape(f"Cannot find path '{path}'")):
+            copy_files([path], use_watcher=False)
+    assert mock_popen.call_args[1]["encoding"] == "utf-8"
+    line = proc.stdin.write.call_args[0][0]
+    assert line.isascii()
+    assert decode_powershell_line(line) == f"Set-Clipboard -LiteralPath @('{path}')"
+    mock_subprocess_run.assert_not_called()
+
+def test_copy_files_windows_persistent_shell_error(temp_files, mock_subprocess_run, mock_powershell, mock_env):
+    """Test that an error reported by the persistent PowerShell is raised."""
+    _, _, reply = mock_powershell
+    reply["line"] = "__FILECLIP_DONE__" + base64.b64encode(b"Access denied").decode() + "\n"
+    with patch("sys.platform", "win32"):
+        with pytest.raises(RuntimeError, match="Windows clipboard error: Access denied"):
+            copy_files(temp_files, use_watcher=False)
+    mock_subprocess_run.assert_not_called()
 
-def test_copy_files_windows_mocked(temp_files, mock_subprocess_run, mock_env):
-    """Test copy_files on Windows by mocking platform."""
+def test_copy_files_windows_persistent_shell_fallback(temp_files, mock_subprocess_run, mock_powershell, mock_env):
+    """Test fallback to a one-shot PowerShell when the persistent one cannot start."""
+    mock_popen, _, _ = mock_powershell
+    mock_popen.side_effect = FileNotFoundError("powershell.exe")
     with patch("sys.platform", "win32"):
-        result = copy_files(temp_files, use_watcher=False)
-        assert result is True
-        mock_subprocess_run.assert_called_once()
-        assert "powershell.exe" in mock_subprocess_run.call_args[0][0]
-        assert all(os.path.abspath(f) in mock_subprocess_run.call_args[0][0] for f in temp_files)
+        assert copy_files(temp_files, use_watcher=False) is True
+    mock_subprocess_run.assert_called_once()
+    assert "powershell.exe" in mock_subprocess_run.call_args[0][0]
 
-def test_copy_files_with_watcher(temp_files, mock_container, mock_env, mock_file_io, mock_watchdog_observer, mock_subprocess_run):
+def test_copy_files_with_watcher(temp_files, mock_container, mock_env, mock_watchdog_observer, mock_subprocess_run):
     """Test copy_files with watcher mode."""
     env = mock_env
-    shared_dir = Path(env['container_workspace']) / ".fileclip"
+    shared_dir = Path(env['shared_dir'])
     shared_dir.mkdir(parents=True, exist_ok=True)
-    open_mock, load_mock, dump_mock = mock_file_io
-    open_mock.return_value = MagicMock()  # Mock file context
-    load_mock.return_value = {"success": True, "message": "Copied 3 files"}
     
     with patch("fileclip.file_clip.check_watcher", return_value=True):
         with patch("fileclip.file_clip.wait_for_results", return_value={"success": True, "message": "Copied 3 files"}):
             result = copy_files(temp_files, use_watcher=True)
             assert result is True
-            dump_mock.assert_called()  # JSON dump for fileclip_request_<uuid>.json
-            load_mock.assert_not_called()  # Since wait_for_results is mocked, load is not called in test
+            request_files = list(shared_dir.glob("fileclip_request_*.json"))
+            assert len(request_files) == 1  # Request left in place since wait_for_results is mocked
+            assert json.loads(request_files[0].read_text())["action"] == "copy_files"
             mock_subprocess_run.assert_not_called()  # No fallback to direct copy
 
-def test_copy_files_watcher_failure(temp_files, mock_container, mock_env, mock_subprocess_run, mock_file_io, mock_watchdog_observer, monkeypatch):
+def test_copy_files_watcher_failure(temp_files, mock_container, linux_display_env, mock_env, mock_subprocess_run, mock_watchdog_observer):
     """Test copy_files with watcher failure and fallback."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
     env = mock_env
-    shared_dir = Path(env['container_workspace']) / ".fileclip"
+    shared_dir = Path(env['shared_dir'])
     shared_dir.mkdir(parents=True, exist_ok=True)
-    open_mock, load_mock, dump_mock = mock_file_io
-    open_mock.return_value = MagicMock()
-    load_mock.return_value = {"success": False, "message": "Watcher error"}
     
     with patch("fileclip.file_clip.check_watcher", return_value=True):
         with patch("fileclip.file_clip.wait_for_results", return_value={"success": False, "message": "Watcher error"}):
             result = copy_files(temp_files, use_watcher=True)
             assert result is True  # Fallback succeeds
-            dump_mock.assert_called()  # JSON dump for fileclip_request_<uuid>.json
-            load_mock.assert_not_called()  # Since wait_for_results is mocked, load is not called in test
+            assert len(list(shared_dir.glob("fileclip_request_*.json"))) == 1
             mock_subprocess_run.assert_called()  # Fallback called _copy_files_direct
 
-def test_copy_files_no_watcher(temp_files, mock_container, mock_subprocess_run, mock_env, monkeypatch):
+def test_copy_files_no_watcher(temp_files, mock_container, mock_subprocess_run, linux_display_env, mock_env):
     """Test copy_files with watcher disabled."""
-    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
     result = copy_files(temp_files, use_watcher=False)
     assert result is True
     mock_subprocess_run.assert_called()
@@ -505,8 +749,82 @@ def test_copy_files_no_watcher(temp_files, mock_container, mock_subprocess_run,
 def test_collect_files(temp_files, temp_dir_with_files):
     """Test collect_files for files and directories."""
     dir_path, dir_files = temp_dir_with_files
-    files = collect_files(temp_files + [dir_path])
-    assert set(files) == set(temp_files + dir_files)
+    files = collect_files([*temp_files, dir_path])
+    assert tuple(files[:len(temp_files)]) == temp_files  # Explicit files keep argument order
+    assert frozenset(files[len(temp_files):]) == frozenset(dir_files)  # Directory listing order is not defined
+
+def test_collect_files_nested_and_symlinks(tmp_path):
+    """Test collect_files walks subdirectories, keeps symlinked files and skips symlinked directories."""
+    root = tmp_path / "root"
+    (root / "sub" / "deeper").mkdir(parents=True)
+    (root / "top.txt").write_text("top")
+    (root / "sub" / "deeper" / "leaf.txt").write_text("leaf")
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "target.txt").write_text("target")
+    try:
+        (root / "file_link.txt").symlink_to(outside / "target.txt")
+        (root / "dir_link").symlink_to(outside, target_is_directory=True)
+    except OSError:
+        pytest.skip("Symlinks not supported")
+    files = collect_files([str(root)])
+    assert set(files) == {
+        str(root / "top.txt"),
+        str(root / "sub" / "deeper" / "leaf.txt"),
+        str(root / "file_link.txt"),
+    }
+
+def test_collect_files_skips_unreadable_dirs(tmp_path, monkeypatch):
+    """Test collect_files skips subdirectories it cannot list instead of failing."""
+    root = tmp_path / "root"
+    (root / "locked").mkdir(parents=True)
+    (root / "locked" / "hidden.txt").write_text("hidden")
+    (root / "top.txt").write_text("top")
+    # Refuse the listing directly; chmod does not stop a test run as root
+    real_scandir = os.scandir
+    def scandir(path):
+        if path == str(root / "locked"):
+            raise PermissionError(13, "Permission denied", path)
+        return real_scandir(path)
+    monkeypatch.setattr(os, "scandir", scandir)
+    assert collect_files([str(root)]) == [str(root / "top.txt")]
+
+def test_collect_files_keeps_symlinks(tmp_path, monkeypatch):
+    """Test collect_files returns absolute paths without resolving symlinks."""
+    target = tmp_path / "target.txt"
+    target.write_text("target")
+    try:
+        (tmp_path / "link.txt").symlink_to(target)
+    except OSError:
+        pytest.skip("Symlinks not supported")
+    monkeypatch.chdir(tmp_path)
+    assert collect_files(["link.txt"]) == [str(tmp_path / "link.txt")]
+
+def test_collect_files_many_paths(tmp_path):
+    """Test collect_files keeps argument order and reports the first missing path when stat'ing in parallel."""
+    # Hard-link one template file instead of writing each file's content
+    template = tmp_path / "template.txt"
+    template.write_bytes(b"content")
+    paths = [str(tmp_path / f"file{i}.txt") for i in range(file_clip.PARALLEL_STAT_THRESHOLD * 2)]
+    for path in paths:
+        os.link(template, path)
+    assert collect_files(paths) == paths
+    with pytest.raises(FileNotFoundError, match="missing1"):
+        collect_files(paths[:5] + [str(tmp_path / "missing1"), str(tmp_path / "missing2")] + paths[5:])
+
+def test_map_paths_thread_pool():
+    """Test map_paths checks short lists inline and longer lists from a thread pool, keeping order."""
+    short = [f"p{i}" for i in range(file_clip.PARALLEL_STAT_THRESHOLD - 1)]
+    threads = set()
+    def check(path):
+        threads.add(threading.get_ident())
+        return path.upper()
+    assert file_clip.map_paths(check, short) == [p.upper() for p in short]
+    assert threads == {threading.get_ident()}
+    threads.clear()
+    long = [f"p{i}" for i in range(file_clip.PARALLEL_STAT_THRESHOLD)]
+    assert file_clip.map_paths(check, long) == [p.upper() for p in long]
+    assert threading.get_ident() not in threads
 
 def test_collect_files_invalid():
     """Test collect_files with invalid path."""
@@ -1,10 +1,16 @@
+import os
 import pytest
 import json
 import logging
+import signal
 import sys
-from unittest.mock import patch, MagicMock, mock_open
+import threading
+import time
+import uuid
+from unittest.mock import patch, MagicMock
 from pathlib import Path
-from fileclip.fileclip_watcher import setup_logging, FileclipHandler, process_file, write_result, main
+from watchdog.events import FileCreatedEvent, FileMovedEvent
+from fileclip.fileclip_watcher import setup_logging, stop_logging, FileclipHandler, process_file, process_batch, handle_request, write_result, main, ACTIONS, POLL_INTERVAL
 
 # Fixture for temporary shared directory
 @pytest.fixture
@@ -13,26 +19,37 @@ def shared_dir(tmp_path):
     shared_dir = tmp_path / ".fileclip"
     shared_dir.mkdir(parents=True, exist_ok=True)
     yield shared_dir
-    # Ensure logging is shut down to flush files
-    logging.shutdown()
 
-# Fixture for mocking file I/O
+# Fixture restoring the fileclip.watcher logger after a test calls setup_logging, so no handler leaks into later tests
 @pytest.fixture
-def mock_file_io():
-    """Mock file I/O operations."""
-    with patch("builtins.open", new_callable=mock_open) as mock_file, \
-         patch("json.load") as mock_load, \
-         patch("json.dump") as mock_dump:
-        mock_file.return_value.__enter__.return_value = MagicMock()
-        yield mock_file, mock_load, mock_dump
+def watcher_logger():
+    logger = logging.getLogger("fileclip.watcher")
+    saved = logger.handlers[:], logger.level, logger.propagate
+    yield logger
+    stop_logging()  # Writes out queued records and closes the log file
+    logger.handlers, logger.level, logger.propagate = saved
+
+# Keep main() from switching the whole test session to a persistent PowerShell
+@pytest.fixture(autouse=True)
+def no_persistent_shell():
+    with patch("fileclip.fileclip_watcher.enable_persistent_shell") as mock_enable:
+        yield mock_enable
+
+# Request data from the test sender; keyword arguments add fields or override sender and request_id
+def make_payload(**fields):
+    return {"sender": "container_test-host_1234", "request_id": "test-uuid", **fields}
+
+# Read back the result process_file wrote for a request
+def read_result(shared_dir, request_id="test-uuid"):
+    return json.loads((shared_dir / "results" / f"fileclip_results_{request_id}.json").read_text())
 
 # Fixture for mocking watchdog observer
 @pytest.fixture
-def mock_watchdog_observer():
+def mock_watchdog_observer(monkeypatch):
     """Mock watchdog observer and event handler."""
-    with patch("fileclip.fileclip_watcher.PollingObserver") as mock_observer:
-        mock_observer_instance = MagicMock()
-        mock_observer.return_value = mock_observer_instance
+    monkeypatch.delenv("FILECLIP_FORCE_POLLING", raising=False)
+    with patch("fileclip.fileclip_watcher.Observer", autospec=True) as mock_observer, \
+         patch("fileclip.file_clip.is_network_fs", return_value=False):
         yield mock_observer
 
 # Fixture for mocking copy_files
@@ -43,67 +60,213 @@ def mock_copy_files():
         mock_copy.return_value = True
         yield mock_copy
 
-# Fixture for temporary files
-@pytest.fixture
-def temp_files(tmp_path):
-    """Create temporary files for testing."""
-    file1 = tmp_path / "file1.txt"
-    file2 = tmp_path / "file2.pdf"
-    file1.write_text("File 1 content")
-    file2.write_text("File 2 content")
-    return [str(file1), str(file2)]
-
 # Test setup_logging
-def test_setup_logging(shared_dir, caplog):
+def test_setup_logging(shared_dir, watcher_logger, caplog):
     """Test logging setup."""
     log_file = shared_dir / "fileclip_watcher.log"
     caplog.set_level(logging.INFO, logger="fileclip.watcher")
     
     setup_logging(log_file, "INFO")
-    logging.getLogger("fileclip.watcher").info("Test log message")
+    watcher_logger.info("Test log message")
+    stop_logging()  # Records are written by a background listener
     
-    assert log_file.exists()
-    with open(log_file, "r") as f:
-        log_content = f.read()
+    log_content = log_file.read_text()
     assert "Test log message" in log_content
     assert "INFO" in log_content
-    assert logging.getLogger("fileclip.watcher").level == logging.INFO
+    assert watcher_logger.level == logging.INFO
 
-def test_setup_logging_invalid_level(shared_dir, caplog):
+def test_setup_logging_invalid_level(shared_dir, watcher_logger, caplog):
     """Test setup_logging with invalid log level."""
     log_file = shared_dir / "fileclip_watcher.log"
     caplog.set_level(logging.WARNING, logger="fileclip.watcher")
     
     setup_logging(log_file, "INVALID")
-    assert logging.getLogger("fileclip.watcher").level == logging.INFO  # Falls back to INFO
-    logging.getLogger("fileclip.watcher").warning("Test log message")
-    assert log_file.exists()
-    with open(log_file, "r") as f:
-        log_content = f.read()
+    assert watcher_logger.level == logging.INFO  # Falls back to INFO
+    watcher_logger.warning("Test log message")
+    stop_logging()
+    log_content = log_file.read_text()
     assert "Test log message" in log_content
     assert "WARNING" in log_content
 
+def test_setup_logging_writes_off_thread(shared_dir, watcher_logger):
+    """Test log records are written to the file by the listener thread, not the thread that logs them."""
+    log_file = shared_dir / "fileclip_watcher.log"
+    writer_threads = []
+    real_emit = logging.FileHandler.emit
+    def emit(self, record):
+        if self.baseFilename == str(log_file):  # pytest installs FileHandlers of its own
+            writer_threads.append(threading.get_ident())
+        real_emit(self, record)
+    with patch.object(logging.FileHandler, "emit", emit):
+        setup_logging(log_file, "DEBUG")
+        watcher_logger.debug("Queued message")
+        stop_logging()
+    assert writer_threads and threading.get_ident() not in writer_threads
+    assert "Queued message" in log_file.read_text()
+
+# Build FileclipHandlers whose worker threads are stopped when the test ends
+@pytest.fixture
+def make_handler():
+    handlers = []
+    def make(*args, **kwargs):
+        handlers.append(FileclipHandler(*args, **kwargs))
+        return handlers[-1]
+    yield make
+    for handler in handlers:
+        handler.stop()
+
 # Test FileclipHandler
-def test_fileclip_handler_init(shared_dir):
+def test_fileclip_handler_init(shared_dir, make_handler):
     """Test FileclipHandler initialization."""
-    handler = FileclipHandler(shared_dir)
+    handler = make_handler(shared_dir)
     assert handler.shared_dir == shared_dir
-    assert handler.patterns == ["fileclip_request_*.json"]
+    assert handler.q.empty()
+    assert handler.worker.is_alive()
 
-def test_fileclip_handler_on_created(shared_dir, mock_copy_files):
+def test_fileclip_handler_stop(shared_dir):
+    """Test FileclipHandler.stop processes requests still queued, then ends the worker thread."""
+    handler = FileclipHandler(shared_dir, batch_window=0.5)
+    path = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    path.write_text("{}")
+    
+    with patch("fileclip.fileclip_watcher.process_batch") as mock_batch:
+        handler.q.put(path)
+        handler.stop()
+        mock_batch.assert_called_once_with([path], shared_dir)
+    assert not handler.worker.is_alive()
+    assert handler.q.unfinished_tasks == 0
+
+def test_fileclip_handler_on_created(shared_dir, mock_copy_files, make_handler):
     """Test FileclipHandler on_created method."""
-    handler = FileclipHandler(shared_dir)
+    handler = make_handler(shared_dir)
     event = MagicMock()
     event.is_directory = False
-    event.src_path = str(shared_dir / "fileclip_request_test-uuid.json")
+    event.src_path = str(shared_dir / "fileclip_request_123e4567-e89b-42d3-a456-426614174000.json")
+    Path(event.src_path).write_text("{}")
     
     with patch("fileclip.fileclip_watcher.process_file") as mock_process:
         handler.on_created(event)
+        handler.q.join()
         mock_process.assert_called_once_with(Path(event.src_path), shared_dir)
 
-def test_fileclip_handler_on_created_directory(shared_dir):
+def test_fileclip_handler_on_moved(shared_dir, make_handler):
+    """Test FileclipHandler queues requests renamed into place."""
+    handler = make_handler(shared_dir)
+    event = MagicMock()
+    event.is_directory = False
+    event.src_path = str(shared_dir / "fileclip_request_123e4567-e89b-42d3-a456-426614174000.json.tmp")
+    event.dest_path = str(shared_dir / "fileclip_request_123e4567-e89b-42d3-a456-426614174000.json")
+    Path(event.dest_path).write_text("{}")
+    
+    with patch("fileclip.fileclip_watcher.process_file") as mock_process:
+        handler.on_moved(event)
+        handler.q.join()
+        mock_process.assert_called_once_with(Path(event.dest_path), shared_dir)
+
+def test_fileclip_handler_coalesces_burst(shared_dir, make_handler):
+    """Test FileclipHandler processes requests arriving within the batch window as one batch."""
+    handler = make_handler(shared_dir, batch_window=0.5)
+    paths = [shared_dir / f"fileclip_request_{uuid.uuid4()}.json" for i in range(3)]
+    
+    with patch("fileclip.fileclip_watcher.process_batch") as mock_batch:
+        for i, path in enumerate(paths):
+            path.write_text("{}")
+            os.utime(path, (1000 + i, 1000 + i))
+            event = MagicMock()
+            event.is_directory = False
+            event.src_path = str(path)
+            handler.on_created(event)
+            time.sleep(0.01)
+        handler.q.join()
+        mock_batch.assert_called_once_with(paths, shared_dir)
+
+def test_fileclip_handler_sweeps_pending_requests(shared_dir, make_handler):
+    """Test FileclipHandler processes every pending request oldest first, skipping ones already handled."""
+    handler = make_handler(shared_dir)
+    missed = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    reported = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    handled = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    for mtime, path in ((2000, reported), (1000, missed)):
+        path.write_text("{}")
+        os.utime(path, (mtime, mtime))
+    (shared_dir / "fileclip_watcher.log").write_text("")
+    
+    with patch("fileclip.fileclip_watcher.process_batch") as mock_batch:
+        for path in (handled, reported):
+            event = MagicMock()
+            event.is_directory = False
+            event.src_path = str(path)
+            handler.on_created(event)
+        handler.q.join()
+        mock_batch.assert_called_once_with([missed, reported], shared_dir)
+
+def test_fileclip_handler_skips_undeletable_request(shared_dir, make_handler):
+    """Test FileclipHandler answers a request it cannot delete once, then skips it so later requests still run."""
+    handler = make_handler(shared_dir)
+    stuck = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    stuck.write_text(json.dumps(make_payload(action="ping", request_id="uuid-stuck")))
+    os.utime(stuck, (1000, 1000))  # Oldest, so it would come first on every sweep
+    real_unlink = os.unlink
+    def unlink(path):
+        if Path(path) == stuck:
+            raise PermissionError(13, "Permission denied", str(path))
+        real_unlink(path)
+
+    def request(request_id):
+        path = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+        path.write_text(json.dumps(make_payload(action="ping", request_id=request_id)))
+        event = MagicMock()
+        event.is_directory = False
+        event.src_path = str(path)
+        handler.on_created(event)
+        handler.q.join()
+        return path
+
+    with patch("os.unlink", side_effect=unlink), \
+         patch("fileclip.fileclip_watcher.handle_request", wraps=handle_request) as mock_handle:
+        first = request("uuid-1")
+        (shared_dir / "results" / "fileclip_results_uuid-stuck.json").unlink()
+        second = request("uuid-2")
+    assert handler.stuck == {stuck}
+    assert [c[0][0]["request_id"] for c in mock_handle.call_args_list] == ["uuid-stuck", "uuid-1", "uuid-2"]
+    assert read_result(shared_dir, "uuid-2")["message"] == "Ping acknowledged"
+    assert not (shared_dir / "results" / "fileclip_results_uuid-stuck.json").exists()
+    assert not first.exists() and not second.exists()
+    assert stuck.exists()
+
+def test_fileclip_handler_failing_request(shared_dir, make_handler):
+    """Test a request whose handling raises gets an error result and is removed, so later requests still run."""
+    handler = make_handler(shared_dir)
+    bad = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    bad.write_text(json.dumps(make_payload(action="boom", request_id="uuid-bad")))
+    os.utime(bad, (1000, 1000))  # Oldest, so it comes first in the sweep
+    good = shared_dir / f"fileclip_request_{uuid.uuid4()}.json"
+    good.write_text(json.dumps(make_payload(action="ping", request_id="uuid-good")))
+
+    with patch.dict(ACTIONS, {"boom": MagicMock(side_effect=RuntimeError("boom"))}):
+        event = MagicMock()
+        event.is_directory = False
+        event.src_path = str(good)
+        handler.on_created(event)
+        handler.q.join()
+    assert read_result(shared_dir, "uuid-bad") == {
+        "success": False,
+        "message": "Failed to process request: boom",
+        "sender": "container_test-host_1234",
+        "request_id": "uuid-bad",
+        "errors": ["boom"],
+    }
+    assert read_result(shared_dir, "uuid-good")["message"] == "Ping acknowledged"
+    assert not bad.exists() and not good.exists()
+
+def test_process_file_already_handled(shared_dir):
+    """Test process_file ignores a request file that is already gone without writing a result."""
+    process_file(shared_dir / f"fileclip_request_{uuid.uuid4()}.json", shared_dir)
+    assert not (shared_dir / "results").exists()
+
+def test_fileclip_handler_on_created_directory(shared_dir, make_handler):
     """Test FileclipHandler ignores directory events."""
-    handler = FileclipHandler(shared_dir)
+    handler = make_handler(shared_dir)
     event = MagicMock()
     event.is_directory = True
     event.src_path = str(shared_dir / "some_dir")
@@ -112,9 +275,9 @@ def test_fileclip_handler_on_created_directory(shared_dir):
         handler.on_created(event)
         mock_process.assert_not_called()
 
-def test_fileclip_handler_on_created_non_matching(shared_dir):
+def test_fileclip_handler_on_created_non_matching(shared_dir, make_handler):
     """Test FileclipHandler ignores non-matching files."""
-    handler = FileclipHandler(shared_dir)
+    handler = make_handler(shared_dir)
     event = MagicMock()
     event.is_directory = False
     event.src_path = str(shared_dir / "non_fileclip_file.txt")
@@ -123,174 +286,175 @@ def test_fileclip_handler_on_created_non_matching(shared_dir):
         handler.on_created(event)
         mock_process.assert_not_called()
 
+@pytest.mark.parametrize("name", [
+    "fileclip_request_not-a-uuid.json",
+    "fileclip_request_123e4567-e89b-42d3-a456-426614174000.json.tmp",
+    "fileclip_results_123e4567-e89b-42d3-a456-426614174000.json",
+])
+def test_fileclip_handler_ignores_malformed_names(shared_dir, name, make_handler):
+    """Test FileclipHandler only queues request files named with a UUID."""
+    handler = make_handler(shared_dir)
+    event = MagicMock()
+    event.is_directory = False
+    event.src_path = str(shared_dir / name)
+    handler.on_created(event)
+    assert handler.q.empty()
+
 # Test process_file
-def test_process_file_ping(shared_dir, mock_file_io):
-    """Test process_file with ping action."""
-    file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "ping",
-        "sender": "container_test-host_1234",
-        "request_id": "test-uuid"
-    }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is True
-        assert result["message"] == "Ping acknowledged"
-        assert result["sender"] == "container_test-host_1234"
-        assert result["request_id"] == "test-uuid"
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_copy_files_valid(shared_dir, temp_files, mock_file_io, mock_copy_files):
-    """Test process_file with valid copy_files action."""
+
+# Stands for the test corpus (temp_files) in the request paths and copy_files calls below
+CORPUS = "<temp_files>"
+
+# (request file contents, copy_files error, paths copy_files is called with, success, message, errors)
+PROCESS_FILE_CASES = [
+    pytest.param(make_payload(action="ping"), None, None, True, "Ping acknowledged", [], id="ping"),
+    pytest.param(make_payload(action="copy_files", paths=[CORPUS]),
+                 None, [CORPUS], True, "Copied {count} file(s)", [], id="copy_files_valid"),
+    pytest.param(make_payload(action="copy_files", paths=["nonexistent.txt"]),
+                 None, None, False, "No valid files to copy", ["Invalid or inaccessible path: nonexistent.txt"], id="copy_files_invalid_path"),
+    pytest.param(make_payload(action="copy_files", paths=[CORPUS, "nonexistent.txt"]),
+                 None, [CORPUS], True, "Copied {count} file(s)", ["Invalid or inaccessible path: nonexistent.txt"], id="copy_files_mixed_paths"),
+    pytest.param(b"{not json", None, None, False, "Invalid JSON", [], id="invalid_json"),
+    pytest.param({"action": "ping"}, None, None, False, "Missing request_id or sender", [], id="missing_fields"),
+    pytest.param(["sender", "request_id"], None, None, False, "Missing request_id or sender", [], id="not_an_object_list"),
+    pytest.param("sender request_id", None, None, False, "Missing request_id or sender", [], id="not_an_object_string"),
+    pytest.param(42, None, None, False, "Missing request_id or sender", [], id="not_an_object_number"),
+    pytest.param(make_payload(action="ping", sender=["a"]), None, None, False, "Missing request_id or sender", [], id="sender_not_a_string"),
+    pytest.param(make_payload(action="ping", request_id={"id": 1}), None, None, False, "Missing request_id or sender", [], id="request_id_not_a_string"),
+    pytest.param(make_payload(action="invalid_action"), None, None, False, "Unknown action: invalid_action", [], id="unknown_action"),
+    pytest.param(make_payload(action="copy_files", paths=[CORPUS]),
+                 RuntimeError("Clipboard error"), [CORPUS], False, "Failed to copy files: Clipboard error", ["Clipboard error"], id="copy_files_error"),
+]
+
+@pytest.mark.parametrize("request_data, copy_error, copied, success, message, errors", PROCESS_FILE_CASES)
+def test_process_file(request_data, copy_error, copied, success, message, errors, shared_dir, temp_files, mock_copy_files):
+    """Test process_file writes the expected result for each kind of request and always removes the request file."""
+    def expand(paths):
+        return [p for path in paths for p in (temp_files if path == CORPUS else [path])]
     file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "copy_files",
-        "sender": "container_test-host_1234",
-        "request_id": "test-uuid",
-        "paths": temp_files
-    }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
+    if isinstance(request_data, bytes):
+        file_path.write_bytes(request_data)
+    else:
+        if isinstance(request_data, dict) and "paths" in request_data:
+            request_data = {**request_data, "paths": expand(request_data["paths"])}
+        file_path.write_text(json.dumps(request_data))
+    mock_copy_files.side_effect = copy_error
+    # Requests that cannot be read or lack sender/request_id are answered as "unknown"
+    accepted = isinstance(request_data, dict) and all(isinstance(request_data.get(key), str) for key in ("sender", "request_id"))
+    sender, request_id = (request_data["sender"], request_data["request_id"]) if accepted else ("unknown", "unknown")
     
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        mock_copy_files.assert_called_once_with(temp_files, use_watcher=False)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is True
-        assert result["message"] == f"Copied {len(temp_files)} file(s)"
-        assert result["sender"] == "container_test-host_1234"
-        assert result["request_id"] == "test-uuid"
-        assert result["errors"] == []
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_copy_files_invalid_path(shared_dir, mock_file_io, mock_copy_files):
-    """Test process_file with invalid paths."""
-    file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "copy_files",
-        "sender": "container_test-host_1234",
-        "request_id": "test-uuid",
-        "paths": ["nonexistent.txt"]
+    process_file(file_path, shared_dir)
+    assert read_result(shared_dir, request_id) == {
+        "success": success,
+        "message": message.format(count=len(temp_files)),
+        "sender": sender,
+        "request_id": request_id,
+        "errors": errors,
     }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
+    if copied is None:
         mock_copy_files.assert_not_called()
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is False
-        assert result["message"] == "No valid files to copy"
-        assert result["errors"] == ["Invalid or inaccessible path: nonexistent.txt"]
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_copy_files_mixed_paths(shared_dir, temp_files, mock_file_io, mock_copy_files):
-    """Test process_file with mixed valid and invalid paths."""
-    file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "copy_files",
-        "sender": "container_test-host_1234",
-        "request_id": "test-uuid",
-        "paths": temp_files + ["nonexistent.txt"]
-    }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        mock_copy_files.assert_called_once_with(temp_files, use_watcher=False)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is True
-        assert result["message"] == f"Copied {len(temp_files)} file(s)"
-        assert result["errors"] == ["Invalid or inaccessible path: nonexistent.txt"]
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_invalid_json(shared_dir, mock_file_io):
-    """Test process_file with invalid JSON."""
-    file_path = shared_dir / "fileclip_request_test-uuid.json"
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.side_effect = json.JSONDecodeError("Invalid JSON", "", 0)
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is False
-        assert result["message"] == "Invalid JSON"
-        assert result["sender"] == "unknown"
-        assert result["request_id"] == "unknown"
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_missing_fields(shared_dir, mock_file_io):
-    """Test process_file with missing request_id or sender."""
-    file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "ping"
-        # Missing sender and request_id
-    }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is False
-        assert result["message"] == "Missing request_id or sender"
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_unknown_action(shared_dir, mock_file_io):
-    """Test process_file with unknown action."""
-    file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "invalid_action",
-        "sender": "container_test-host_1234",
-        "request_id": "test-uuid"
-    }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is False
-        assert result["message"] == "Unknown action: invalid_action"
-        mock_unlink.assert_called_once_with(missing_ok=True)
-
-def test_process_file_copy_files_error(shared_dir, temp_files, mock_file_io, mock_copy_files):
-    """Test process_file when copy_files raises an error."""
+    else:
+        mock_copy_files.assert_called_once_with(expand(copied), use_watcher=False)
+    assert not file_path.exists()
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_process_file_real_json(shared_dir, monkeypatch, use_orjson):
+    """Test process_file parses real request files, and reports invalid ones, with and without orjson."""
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr("fileclip.file_clip.orjson", None)
+    request_id = str(uuid.uuid4())
+    file_path = shared_dir / f"fileclip_request_{request_id}.json"
+    file_path.write_text(json.dumps(make_payload(action="ping", request_id=request_id)))
+    process_file(file_path, shared_dir)
+    assert read_result(shared_dir, request_id)["message"] == "Ping acknowledged"
+
+    file_path.write_text("{not json")
+    process_file(file_path, shared_dir)
+    assert read_result(shared_dir, "unknown")["message"] == "Invalid JSON"
+    assert not file_path.exists()
+
+def test_process_file_undeletable(shared_dir, caplog):
+    """Test process_file still answers a request it cannot delete, logging the error instead of raising."""
     file_path = shared_dir / "fileclip_request_test-uuid.json"
-    json_data = {
-        "action": "copy_files",
-        "sender": "container_test-host_1234",
-        "request_id": "test-uuid",
-        "paths": temp_files
-    }
-    open_mock, load_mock, dump_mock = mock_file_io
-    load_mock.return_value = json_data
-    mock_copy_files.side_effect = RuntimeError("Clipboard error")
-    
-    with patch("pathlib.Path.unlink") as mock_unlink:
-        process_file(file_path, shared_dir)
-        mock_copy_files.assert_called_once_with(temp_files, use_watcher=False)
-        dump_mock.assert_called_once()
-        result = dump_mock.call_args[0][0]
-        assert result["success"] is False
-        assert result["message"] == "Failed to copy files: Clipboard error"
-        assert "Clipboard error" in result["errors"]
-        mock_unlink.assert_called_once_with(missing_ok=True)
+    file_path.write_text(json.dumps(make_payload(action="ping")))
+    with patch("fileclip.fileclip_watcher.try_unlink", side_effect=PermissionError("Permission denied")):
+        assert process_file(file_path, shared_dir) is False
+    assert read_result(shared_dir)["message"] == "Ping acknowledged"
+    assert "Failed to remove request file" in caplog.text
+
+# Test handle_request
+def test_handle_request_dispatch(shared_dir):
+    """Test handle_request calls the handler registered for the action."""
+    data = make_payload(action="custom")
+    custom = MagicMock()
+    with patch.dict(ACTIONS, {"custom": custom}):
+        handle_request(data, shared_dir)
+    custom.assert_called_once_with(data, shared_dir)
+    assert not (shared_dir / "results").exists()
+
+# Test process_batch
+def test_process_batch_merges_same_sender(shared_dir, temp_files, mock_copy_files):
+    """Test process_batch copies requests from one sender with a single copy_files call."""
+    requests = [
+        make_payload(action="copy_files", request_id="uuid-1", paths=[temp_files[0]]),
+        make_payload(action="copy_files", request_id="uuid-2", paths=[temp_files[1], "nonexistent.txt"]),
+        make_payload(action="ping", request_id="uuid-3"),
+    ]
+    file_paths = []
+    for data in requests:
+        file_path = shared_dir / f"fileclip_request_{data['request_id']}.json"
+        file_path.write_text(json.dumps(data))
+        file_paths.append(file_path)
+
+    process_batch(file_paths, shared_dir)
+
+    mock_copy_files.assert_called_once_with(list(temp_files[:2]), use_watcher=False)
+    results = {data["request_id"]: read_result(shared_dir, data["request_id"]) for data in requests}
+    assert results["uuid-1"]["success"] is True
+    assert results["uuid-1"]["message"] == "Copied 1 file(s)"
+    assert results["uuid-2"]["success"] is True
+    assert results["uuid-2"]["errors"] == ["Invalid or inaccessible path: nonexistent.txt"]
+    assert results["uuid-3"]["message"] == "Ping acknowledged"
+    assert not any(p.exists() for p in file_paths)
+
+def test_process_batch_separate_senders(shared_dir, temp_files, mock_copy_files):
+    """Test process_batch keeps requests from different senders in separate copies."""
+    file_paths = []
+    for i, path in enumerate(temp_files):
+        file_path = shared_dir / f"fileclip_request_uuid-{i}.json"
+        file_path.write_text(json.dumps(make_payload(action="copy_files", sender=f"container_test-host_{i}",
+                                                     request_id=f"uuid-{i}", paths=[path])))
+        file_paths.append(file_path)
+
+    process_batch(file_paths, shared_dir)
+
+    assert mock_copy_files.call_count == len(temp_files)
+
+def test_process_batch_failing_group(shared_dir, temp_files, mock_copy_files):
+    """Test process_batch answers every request when one sender's copy raises, and removes every request file."""
+    requests = [
+        make_payload(action="copy_files", sender="container_bad_1", request_id="uuid-bad", paths=[["not", "a", "path"]]),
+        make_payload(action="copy_files", sender="container_good_2", request_id="uuid-good", paths=[temp_files[0]]),
+    ]
+    file_paths = []
+    for data in requests:
+        file_path = shared_dir / f"fileclip_request_{data['request_id']}.json"
+        file_path.write_text(json.dumps(data))
+        file_paths.append(file_path)
+
+    process_batch(file_paths, shared_dir)
+
+    bad = read_result(shared_dir, "uuid-bad")
+    assert bad["success"] is False
+    assert bad["message"].startswith("Failed to process request: ")
+    assert read_result(shared_dir, "uuid-good")["message"] == "Copied 1 file(s)"
+    mock_copy_files.assert_called_once_with([temp_files[0]], use_watcher=False)
+    assert not any(p.exists() for p in file_paths)
 
 # Test write_result
-def test_write_result(shared_dir, mock_file_io):
+def test_write_result(shared_dir):
     """Test write_result function."""
     result = {
         "sender": "container_test-host_1234",
@@ -299,10 +463,9 @@ def test_write_result(shared_dir, mock_file_io):
         "message": "Test result",
         "errors": []
     }
-    open_mock, load_mock, dump_mock = mock_file_io
     write_result(shared_dir, "test-uuid", result)
-    dump_mock.assert_called_once_with(result, open_mock.return_value.__enter__.return_value)
-    open_mock.assert_called_once_with(shared_dir / "fileclip_results_test-uuid.json", "w")
+    assert read_result(shared_dir) == result
+    assert not list((shared_dir / "results").glob("*.tmp"))
 
 def test_write_result_io_error(shared_dir, caplog):
     """Test write_result with I/O error."""
@@ -315,15 +478,15 @@ def test_write_result_io_error(shared_dir, caplog):
     }
     caplog.set_level(logging.ERROR, logger="fileclip.watcher")
     
-    with patch("fileclip.fileclip_watcher.open", new_callable=mock_open) as mock_file:
-        mock_file.side_effect = OSError("Permission denied")
+    with patch("fileclip.file_clip.os.open", side_effect=OSError("Permission denied")) as mock_os_open:
         write_result(shared_dir, "test-uuid", result)
         assert "Failed to write result" in caplog.text
         assert "Permission denied" in caplog.text
-        mock_file.assert_called_once_with(shared_dir / "fileclip_results_test-uuid.json", "w")
+        assert mock_os_open.call_args[0][0] == shared_dir / "results" / "fileclip_results_test-uuid.json.tmp"
+    assert not list((shared_dir / "results").iterdir())
 
 # Test main
-def test_main(shared_dir, mock_watchdog_observer, mock_copy_files, monkeypatch, caplog):
+def test_main(shared_dir, mock_watchdog_observer, watcher_logger, mock_copy_files, no_persistent_shell, monkeypatch, caplog):
     """Test main function with default settings."""
     monkeypatch.setattr("sys.argv", ["fileclip-watcher", "--log-level=DEBUG"])
     monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", str(shared_dir.parent))
@@ -331,38 +494,90 @@ def test_main(shared_dir, mock_watchdog_observer, mock_copy_files, monkeypatch,
     
     mock_observer = mock_watchdog_observer
     mock_observer_instance = mock_observer.return_value
-    mock_observer_instance.start.return_value = None
-    mock_observer_instance.stop.return_value = None
-    mock_observer_instance.join.return_value = None
     
-    with patch("time.sleep", side_effect=[None, KeyboardInterrupt]):
+    # Ctrl+C once the observer is running; the handler turns it into a shutdown instead of KeyboardInterrupt
+    mock_observer_instance.start.side_effect = lambda: signal.raise_signal(signal.SIGINT)
+    previous_handler = signal.getsignal(signal.SIGINT)
+    main()
+    assert mock_observer.called, "Observer was not instantiated"
+    assert mock_observer_instance.schedule.call_args[0][0].__class__ == FileclipHandler
+    assert mock_observer_instance.schedule.call_args[0][1] == str(shared_dir)
+    assert mock_observer_instance.schedule.call_args[1]["recursive"] is False
+    assert mock_observer_instance.schedule.call_args[1]["event_filter"] == [FileCreatedEvent, FileMovedEvent]
+    mock_observer_instance.start.assert_called_once()
+    mock_observer_instance.stop.assert_called_once()
+    mock_observer_instance.join.assert_called_once()
+    no_persistent_shell.assert_called_once()
+    
+    log_content = (shared_dir / "fileclip_watcher.log").read_text()
+    assert "Starting fileclip-watcher, monitoring" in log_content
+    assert "Received shutdown signal" in log_content
+    assert signal.getsignal(signal.SIGINT) is previous_handler
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Signals cannot interrupt the wait on Windows")
+def test_main_sigterm_during_wait(shared_dir, mock_watchdog_observer, watcher_logger, monkeypatch):
+    """Test main blocks without a timeout until SIGTERM arrives, then shuts down and restores the handler."""
+    monkeypatch.setattr("sys.argv", ["fileclip-watcher"])
+    monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", str(shared_dir.parent))
+    real_wait = threading.Event.wait
+    timeouts = []
+    def wait(self, timeout=None):
+        timeouts.append(timeout)
+        return real_wait(self, timeout)
+    monkeypatch.setattr(threading.Event, "wait", wait)
+
+    sender = threading.Thread(target=lambda: (time.sleep(0.1), os.kill(os.getpid(), signal.SIGTERM)))
+    sender.start()
+    main()
+    sender.join()
+    assert timeouts and all(timeout is None for timeout in timeouts)
+    mock_watchdog_observer.return_value.stop.assert_called_once()
+    assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+
+def test_main_force_polling(shared_dir, mock_watchdog_observer, watcher_logger, monkeypatch):
+    """Test main uses PollingObserver when FILECLIP_FORCE_POLLING is set."""
+    monkeypatch.setattr("sys.argv", ["fileclip-watcher"])
+    monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", str(shared_dir.parent))
+    monkeypatch.setenv("FILECLIP_FORCE_POLLING", "true")
+
+    with patch("fileclip.fileclip_watcher.PollingObserver") as mock_polling, \
+         patch("fileclip.fileclip_watcher._wait_for_shutdown", side_effect=KeyboardInterrupt):
+        main()
+        mock_polling.assert_called_once_with(timeout=POLL_INTERVAL)
+        assert POLL_INTERVAL >= 1.0
+        mock_watchdog_observer.assert_not_called()
+        mock_polling.return_value.start.assert_called_once()
+
+def test_main_network_fs_polling(shared_dir, mock_watchdog_observer, watcher_logger, monkeypatch):
+    """Test main falls back to PollingObserver when the shared directory is on a network filesystem."""
+    monkeypatch.setattr("sys.argv", ["fileclip-watcher"])
+    monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", str(shared_dir.parent))
+
+    with patch("fileclip.file_clip.is_network_fs", return_value=True), \
+         patch("fileclip.fileclip_watcher.PollingObserver") as mock_polling, \
+         patch("fileclip.fileclip_watcher._wait_for_shutdown", side_effect=KeyboardInterrupt):
+        main()
+        mock_polling.assert_called_once_with(timeout=POLL_INTERVAL)
+        mock_watchdog_observer.assert_not_called()
+
+def test_main_shared_dir_override(tmp_path, mock_watchdog_observer, watcher_logger, monkeypatch):
+    """Test main monitors FILECLIP_SHARED_DIR when it is set."""
+    ipc_dir = tmp_path / "ipc"
+    monkeypatch.setattr("sys.argv", ["fileclip-watcher"])
+    monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", str(tmp_path / "workspace"))
+    monkeypatch.setenv("FILECLIP_SHARED_DIR", str(ipc_dir))
+
+    with patch("fileclip.fileclip_watcher._wait_for_shutdown", side_effect=KeyboardInterrupt):
         main()
-        assert mock_observer.called, "PollingObserver was not instantiated"
-        assert mock_observer_instance.schedule.call_args[0][0].__class__ == FileclipHandler
-        assert mock_observer_instance.schedule.call_args[0][1] == str(shared_dir)
-        assert mock_observer_instance.schedule.call_args[1]["recursive"] is False
-        mock_observer_instance.start.assert_called_once()
-        mock_observer_instance.stop.assert_called_once()
-        mock_observer_instance.join.assert_called_once()
-        
-        log_file = shared_dir / "fileclip_watcher.log"
-        assert log_file.exists()
-        with open(log_file, "r") as f:
-            log_content = f.read()
-        assert "Starting fileclip-watcher, monitoring" in log_content
-        assert "Received shutdown signal" in log_content
-
-def test_main_invalid_log_level(shared_dir, mock_watchdog_observer, mock_copy_files, monkeypatch, capsys):
+    assert mock_watchdog_observer.return_value.schedule.call_args[0][1] == str(ipc_dir)
+    assert (ipc_dir / "fileclip_watcher.log").exists()
+    assert not (tmp_path / "workspace").exists()
+
+def test_main_invalid_log_level(shared_dir, mock_watchdog_observer, watcher_logger, mock_copy_files, monkeypatch, capsys):
     """Test main with invalid log level."""
     monkeypatch.setattr("sys.argv", ["fileclip-watcher", "--log-level=INVALID"])
     monkeypatch.setenv("FILECLIP_HOST_WORKSPACE", str(shared_dir.parent))
     
-    mock_observer = mock_watchdog_observer
-    mock_observer_instance = mock_observer.return_value
-    mock_observer_instance.start.return_value = None
-    mock_observer_instance.stop.return_value = None
-    mock_observer_instance.join.return_value = None
-    
     with pytest.raises(SystemExit) as exc_info:
         main()
     assert exc_info.value.code == 2
@@ -1,19 +1,25 @@
-import json
-import os
-import time
-import pytest
 import logging
 import threading
-from pathlib import Path
 from unittest.mock import patch
-from fileclip.fileclip_watcher import main as watcher_main
-from fileclip.main import main as fileclip_main
+
+import pytest
+
+# Skip the module, rather than wait on a watcher that cannot see files, when watchdog is unavailable
+pytest.importorskip("watchdog.observers")
+from watchdog.events import FileSystemEventHandler  # noqa: E402
+
+from fileclip.fileclip_watcher import POLL_INTERVAL, _select_observer  # noqa: E402
+from fileclip.fileclip_watcher import main as watcher_main  # noqa: E402
+from fileclip.main import main as fileclip_main  # noqa: E402
+
+# The watcher thread cannot be stopped from a test, so one watcher, its directories, and its environment
+# serve every test in this module; watcher_log keeps the tests apart.
 
 # Fixture for container and host directories
-@pytest.fixture
-def setup_dirs(tmp_path):
-    """Set up container and host directories with .fileclip subdirs."""
-    workspace = tmp_path / "workspace"
+@pytest.fixture(scope="module")
+def setup_dirs(tmp_path_factory):
+    """Set up container and host directories with .fileclip subdirs (once per module)."""
+    workspace = tmp_path_factory.mktemp("integration") / "workspace"
     workspace.mkdir(parents=True)
     (workspace / ".fileclip").mkdir()
     
@@ -37,7 +43,7 @@ def mock_direct_copy():
         yield mock_direct
 
 # Fixture to mock environment variables
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_env(setup_dirs):
     """Set up environment variables for container and host."""
     env_vars = {
@@ -45,38 +51,72 @@ def mock_env(setup_dirs):
         "FILECLIP_HOST_WORKSPACE": str(setup_dirs["host_dir"]),
         "FILECLIP_USE_WATCHER": "true"
     }
-    with patch.dict(os.environ, env_vars):
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in env_vars.items():
+            mp.setenv(name, value)
         yield env_vars
 
 # Fixture to mock is_container to always return True
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_is_container():
     """Mock fileclip.main.is_container to simulate container environment."""
     with patch("fileclip.main.is_container", return_value=True):
         yield
 
 # Fixture to mock check_watcher
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_check_watcher():
     """Mock fileclip.file_clip.check_watcher to return True."""
     with patch("fileclip.file_clip.check_watcher", return_value=True):
         yield
 
+# Fixture probing, with the observer the watcher would pick, that file creation is reported on this file system
+@pytest.fixture(scope="module")
+def file_events(tmp_path_factory):
+    """Skip the module if a watchdog observer never reports a file created in the test directory."""
+    probe_dir = tmp_path_factory.mktemp("events")
+    seen = threading.Event()
+    handler = FileSystemEventHandler()
+    handler.on_created = lambda event: seen.set()
+    observer = _select_observer(probe_dir)
+    observer.schedule(handler, str(probe_dir), recursive=False)
+    observer.start()
+    try:
+        (probe_dir / "sentinel").touch()
+        # Returns as soon as the event arrives; the bound only matters when none does (one poll for PollingObserver)
+        if not seen.wait(2 * POLL_INTERVAL):
+            pytest.skip("File system does not deliver file events to watchdog")
+    finally:
+        observer.stop()
+        observer.join()
+
 # Fixture to run watcher in background
-@pytest.fixture
-def run_watcher(setup_dirs):
-    """Run fileclip-watcher in a background thread."""
+@pytest.fixture(scope="module")
+def run_watcher(setup_dirs, mock_env, file_events, wait_until):
+    """Run fileclip-watcher in a background thread (once per module)."""
     log_file = setup_dirs["host_dir"] / ".fileclip" / "fileclip_watcher.log"
     with patch("sys.argv", ["fileclip-watcher", "--log-level", "DEBUG"]):
         watcher_thread = threading.Thread(target=watcher_main)
         watcher_thread.daemon = True
         watcher_thread.start()
-        time.sleep(15)  # Increased for macOS CI reliability
-        yield
-        # No explicit stop needed; daemon thread exits with pytest
+        # The observer logs "<class> started" once it is watching, so no request written after this is missed
+        assert wait_until(lambda: log_file.exists() and "Observer started" in log_file.read_text()), "Watcher did not start"
+    yield log_file
+    # No explicit stop needed; daemon thread exits with pytest
+
+# Fixture giving each test the watcher log written since it started, and removing its IPC files afterwards
+@pytest.fixture(autouse=True)
+def watcher_log(setup_dirs, run_watcher):
+    start = run_watcher.stat().st_size
+    yield lambda: run_watcher.read_bytes()[start:].decode()
+    shared_dir = setup_dirs["container_dir"] / ".fileclip"
+    for path in [*shared_dir.glob("fileclip_*.json"), *shared_dir.glob("results/fileclip_*.json")]:
+        path.unlink(missing_ok=True)
 
 # Test integration of fileclip and watcher
-def test_watcher_integration(setup_dirs, mock_direct_copy, mock_env, mock_is_container, mock_check_watcher, run_watcher, caplog):
+@pytest.mark.slow
+@pytest.mark.integration
+def test_watcher_integration(setup_dirs, mock_direct_copy, mock_env, mock_is_container, mock_check_watcher, wait_until, watcher_log, caplog):
     """Test fileclip-to-watcher IPC via shared directory."""
     caplog.set_level(logging.DEBUG, logger="fileclip.watcher")
     caplog.set_level(logging.DEBUG, logger="fileclip.file_clip")
@@ -84,28 +124,23 @@ def test_watcher_integration(setup_dirs, mock_direct_copy, mock_env, mock_is_con
     # Simulate running `pdm run fileclip test.txt --use-watcher --watcher-timeout 20`
     with patch("sys.argv", ["fileclip", str(setup_dirs["test_file"]), "--use-watcher", "--watcher-timeout", "30"]):
         fileclip_main()
-        # Force filesystem sync to ensure request file is written
-        os.sync()
     
-    # Wait for watcher to process
-    time.sleep(20)  # Increased for CI reliability
+    # Wait for the watcher to delete the request and for its (queued) log records to reach the file
+    wait_until(lambda: not list((setup_dirs["container_dir"] / ".fileclip").glob("fileclip_request_*.json"))
+               and "Copied 1 file(s)" in watcher_log())
     
     # Check for request JSON (should be deleted by watcher)
     request_files = list((setup_dirs["container_dir"] / ".fileclip").glob("fileclip_request_*.json"))
     assert len(request_files) == 0, f"Request JSON not cleaned up by watcher: {request_files}"
     
-    # Check watcher log
-    log_file = setup_dirs["host_dir"] / ".fileclip" / "fileclip_watcher.log"
-    assert log_file.exists(), f"Watcher log file not created at {log_file}"
-    with open(log_file, "r") as f:
-        log_content = f.read()
-    assert "Starting fileclip-watcher" in log_content, "Watcher did not start"
+    # Check watcher log (run_watcher already checked that it started)
+    log_content = watcher_log()
     assert "Detected new request file" in log_content, f"Watcher did not detect request JSON. Log:\n{log_content}"
     assert "Successfully read JSON" in log_content, f"Watcher did not read JSON. Log:\n{log_content}"
     assert "Copied 1 file(s)" in log_content, f"Watcher did not process copy request. Log:\n{log_content}"
     
     # Check result JSON (should be deleted by fileclip)
-    result_files = list((setup_dirs["host_dir"] / ".fileclip").glob("fileclip_results_*.json"))
+    result_files = list((setup_dirs["host_dir"] / ".fileclip" / "results").glob("fileclip_results_*.json"))
     assert len(result_files) == 0, f"Result JSON not cleaned up by fileclip: {result_files}. Log:\n{log_content}"
     
     # Verify _copy_files_direct was called with the correct path
@@ -113,7 +148,9 @@ def test_watcher_integration(setup_dirs, mock_direct_copy, mock_env, mock_is_con
     mock_direct_copy.assert_called_once_with([str(setup_dirs["host_test_file"])])
 
 # Test with invalid file
-def test_watcher_invalid_file(setup_dirs, mock_direct_copy, mock_env, mock_is_container, mock_check_watcher, run_watcher, caplog):
+@pytest.mark.slow
+@pytest.mark.integration
+def test_watcher_invalid_file(setup_dirs, mock_direct_copy, mock_env, mock_is_container, mock_check_watcher, watcher_log, caplog):
     """Test fileclip-to-watcher with an invalid file path."""
     caplog.set_level(logging.DEBUG, logger="fileclip.watcher")
     caplog.set_level(logging.DEBUG, logger="fileclip.file_clip")
@@ -123,19 +160,12 @@ def test_watcher_invalid_file(setup_dirs, mock_direct_copy, mock_env, mock_is_co
         with pytest.raises(SystemExit):
             fileclip_main()
     
-    # Wait for watcher (shouldn't process due to early failure)
-    time.sleep(10)  # Increased for CI reliability
-    
     # Check watcher log (no copy should occur)
-    log_file = setup_dirs["host_dir"] / ".fileclip" / "fileclip_watcher.log"
-    assert log_file.exists(), f"Watcher log file not created at {log_file}"
-    with open(log_file, "r") as f:
-        log_content = f.read()
-    assert "Starting fileclip-watcher" in log_content, "Watcher did not start"
+    log_content = watcher_log()
     assert "Copied" not in log_content, f"Watcher processed invalid file. Log:\n{log_content}"
     
     # No result JSON should exist
-    result_files = list((setup_dirs["host_dir"] / ".fileclip").glob("fileclip_results_*.json"))
+    result_files = list((setup_dirs["host_dir"] / ".fileclip" / "results").glob("fileclip_results_*.json"))
     assert len(result_files) == 0, f"Unexpected result JSON found: {result_files}. Log:\n{log_content}"
     
     # _copy_files_direct should not be called